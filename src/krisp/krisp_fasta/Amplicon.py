@@ -1,5 +1,6 @@
 import sys
 import re
+import functools
 import primer3
 from statistics import mean
 from Bio.Data import IUPACData
@@ -39,6 +40,14 @@ primer3_col_key = {n: n.replace("PRIMER_", "").replace("_0", "").lower() for n i
 #         finally:
 #             sys.stdin = _stdin
 
+@functools.lru_cache(maxsize=None)
+def _collapse_column(column):
+    """ Return the IUPAC code of a frozenset of bases in one column """
+    if "*" in column or "N" in column or UNKNOWN_CHAR in column:
+        return 'N'
+    return iupac_key[tuple(sorted(column))]
+
+
 def collapse_to_iupac(seqs):
     """Combine sequences into a consensus using IUPAC ambiguity codes
 
@@ -56,14 +65,9 @@ def collapse_to_iupac(seqs):
     max_len = max(seq_lens)
     if len(set(seq_lens)) != 1:  # TODO: replace with alignment
         return '-' * max_len
-    output = []
-    for i in range(max_len):
-        column = {s[i] for s in seqs}
-        if "*" in column or "N" in column or UNKNOWN_CHAR in column:
-            output.append('N')
-        else:
-            output.append(iupac_key[tuple(sorted(column))])
-    return "".join(output)
+    # Only a handful of distinct columns exist, so their codes are cached
+    # rather than sorted and looked up for every column
+    return "".join([_collapse_column(frozenset(column)) for column in zip(*seqs)])
 
 
 def parse_primer3_settings(file_path):
@@ -357,7 +361,6 @@ class ConservedEndAmplicons:
     calling the str() method or printing directly.
     """
     # Class level variables
-    ENABLE_DOT = False
     P3_ARGS = {}
 
     def __init__(self, ingroup=None):
@@ -520,6 +523,37 @@ class ConservedEndAmplicons:
                 diags.append(i)
         return diags
 
+    def hasIngroupUniqueColumns(self):
+        """ Returns True if any column is unique to the ingroup
+
+        Same as len(self.ingroupUniqueColumns()) > 0, but alignments where the
+        ingroup and outgroup share a diagnostic sequence, which share a base
+        in every column, are rejected without comparing columns.
+        """
+        # Return False if ingroup is not set
+        if self.ingroup is None:
+            return False
+
+        # Get the distinct diagnostic sequences of each group
+        ingroup_diag = set()
+        outgroup_diag = set()
+        for amplicon in self.amplicons:
+            for label in amplicon.labels:
+                if label in self.ingroup:
+                    ingroup_diag.add(amplicon.diagnostic)
+                else:
+                    outgroup_diag.add(amplicon.diagnostic)
+        if not ingroup_diag.isdisjoint(outgroup_diag):
+            return False
+
+        # Stop at the first column unique to the ingroup
+        for i in range(self.diagnosticLength()):
+            ingroup_bases = set([d[i] for d in ingroup_diag])
+            outgroup_bases = set([d[i] for d in outgroup_diag])
+            if ingroup_bases.isdisjoint(outgroup_bases):
+                return True
+        return False
+
     def makeBracket(self):
         """ Make graphical bracket to output with alignment """
         # Get start and end positions of diagnostic sequences
@@ -595,6 +629,50 @@ class ConservedEndAmplicons:
         return output
 
 
+    def _dotRows(self, result):
+        """ Mark nucleotides conserved with the first row as '.' """
+        top_seq = result[0]
+        length = self.ampliconLength()
+        new_result = [top_seq]
+        for seq in result[1:]:
+            dots = ''.join(['.' if b0 == b1 else b1
+                            for b0, b1 in zip(top_seq[:length], seq)])
+            new_result.append(dots + seq[length:])
+        return new_result
+
+    def _dotAnnotation(self, result, text_out):
+        """ Add primer annotations on their own row """
+        result.append(text_out)
+
+    def _bracketRows(self, result):
+        """ Add diagnostic bracket to result """
+        result.append(self.makeBracket())
+        return result
+
+    def _bracketAnnotation(self, result, text_out):
+        """ Add primer annotations around the diagnostic bracket """
+        result[-1] = result[-1].ljust(len(text_out))
+        result[-1] = "".join([annot if bracket == ' ' else bracket
+                              for bracket, annot in zip(result[-1], text_out)])
+
+    # Alignment style used by render_alignment, see setDotAlignment
+    _styleRows = _bracketRows
+    _styleAnnotation = _bracketAnnotation
+
+    @classmethod
+    def setDotAlignment(cls, enable):
+        """ Set whether alignments are rendered with conserved bases as '.'
+
+        The rendering functions are bound here once rather than checking a
+        flag for every alignment.
+        """
+        if enable:
+            cls._styleRows = cls._dotRows
+            cls._styleAnnotation = cls._dotAnnotation
+        else:
+            cls._styleRows = cls._bracketRows
+            cls._styleAnnotation = cls._bracketAnnotation
+
     def render_alignment(self):
         """ Return a string representation of an alignment """
         # Try splitting amplicons based on ingroup, outgroup
@@ -603,7 +681,7 @@ class ConservedEndAmplicons:
             in_result = []
             out_result = []
             for ampl in sorted(self.amplicons, key=lambda x: x.labels):
-                if set(ampl.labels) & set(self.ingroup):
+                if not self.ingroup.isdisjoint(ampl.labels):
                     in_result.append(str(ampl))
                 else:
                     out_result.append(str(ampl))
@@ -612,23 +690,9 @@ class ConservedEndAmplicons:
             for ampl in sorted(self.amplicons, key=lambda x: x.labels):
                 result.append(str(ampl))
 
-        # Switch to dot alignment if enabled
-        if ConservedEndAmplicons.ENABLE_DOT:
-            # Mark conserved nucleotides as '.'
-            top_seq = result[0]
-            new_result = [top_seq]
-            for seq in result[1:]:
-                seq = list(seq)
-                for i in range(self.ampliconLength()):
-                    b0 = top_seq[i]
-                    b1 = seq[i]
-                    if b0 == b1:
-                        seq[i] = '.'
-                new_result.append(''.join(seq))
-            result = new_result
-        else:
-            # Add diagnostic bracket to result
-            result.append(self.makeBracket())
+        # Mark conserved nucleotides or add the diagnostic bracket, the style
+        # is chosen once by setDotAlignment
+        result = self._styleRows(result)
 
         # Add primer 3 primer annotations
         if self.p3 is not None:
@@ -642,13 +706,7 @@ class ConservedEndAmplicons:
                        forward_annot + \
                        ' ' * (reverse_start - forward_start - len(forward_seq) + 1) + \
                        reverse_annot
-            if ConservedEndAmplicons.ENABLE_DOT:
-                result.append(text_out)
-            else:
-                result[-1] = result[-1].ljust(len(text_out))
-                result[-1] = "".join([annot if bracket == ' ' else bracket
-                                      for bracket, annot in zip(result[-1], text_out)])
-
+            self._styleAnnotation(result, text_out)
 
         # Add primer3 statistics for primers
         if self.p3 is not None:
@@ -23,8 +23,8 @@ def filterAlignmentStream(stream, ingroup):
     for alignment in stream:
         # Set the ingroup
         alignment.setIngroup(ingroup)
-        # Determine column numbers of unique SNP's : empty list -> None
-        if len(alignment.ingroupUniqueColumns()) > 0:
+        # Check for a unique SNP, cheaply rejecting shared diagnostics first
+        if alignment.hasIngroupUniqueColumns():
             yield alignment
 
 
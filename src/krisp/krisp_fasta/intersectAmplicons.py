@@ -8,82 +8,42 @@ import time
 from colorama import Fore, Back, Style
 from .shared import *
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 
-def bisect(filename, key):
-    """ Find the largest pointer value s.t. ptr.readline() < key
+# Maximum number of kmer files read at once by a single merge
+MAX_MERGE_FILES = 256
 
-    Parameters
-    ----------
-    filename : str
-        Name of file to bisect
-    key : str
-        Find the largest pointer value s.t. ptr.readline() < key
 
-    Returns
-    -------
-    int
-         Byte index for start of line
+def mergeFanIn():
+    """ Return the number of kmer files a single merge may read at once
 
+    This is MAX_MERGE_FILES, lowered to half of the open file limit so a
+    merge leaves room for the other files a process holds open.
     """
-    # Open filename for reading
-    with open(filename, "r") as fptr:
-        # Get size of file in bytes
-        file_size = fileSize(fptr)
-
-        # Check for Null input
-        if key == "":
-            return file_size, ""
-
-        # bisect
-        last_success = 0
-        bracket = (0, file_size)
-        prev_bracket = None
-        while (bracket != prev_bracket):
-            # Get starting values
-            start, end = bracket
-
-            # Get midpoint
-            midpoint = (start + end) // 2
-
-            # Move ptr to next full line
-            fptr.seek(midpoint)
-            junk = fptr.readline()
-            midpoint = fptr.tell()
+    fan_in = MAX_MERGE_FILES
+    if resource is not None:
+        limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        if limit != resource.RLIM_INFINITY:
+            fan_in = min(fan_in, limit // 2)
+    return max(2, fan_in)
 
-            # Update start, end
-            line = fptr.readline()
-            line = line.split(',')[0]
-            if line < key:
-                start = midpoint
-                last_success = start
-            else:
-                end = midpoint
 
-            # Update bracket
-            prev_bracket = bracket
-            bracket = (start, end)
-        fptr.seek(last_success)
-        return last_success, fptr.readline()
-
-
-def mergeKmerFiles(filename0, filename1, output,
-                   f0_start=None, f0_end=None, f1_start=None):
-    """ Merge files in an output file
+def mergeKmerRange(files, output, starts=None, ends=None):
+    """ Merge sorted kmer files, or a range of them, into an output file
 
     Parameters
     ----------
-    filename0 : str
-        Name of first kmer file to merge
-    filenam1 : str
-        Name of second kmer file to merge
+    files : [str, str, ...]
+        List of sorted kmer filenames to merge
     output : str
         Name of output file to write
-    f0_start : int, optional
-        Start byte of first kmer file
-    f0_end : int, optional
-        End byte of first kmer file
-    f1_start : int, optional
-        Start byte of second kmer file
+    starts : [int, int, ...], optional
+        Start byte of each kmer file
+    ends : [int, int, ...], optional
+        End byte of each kmer file
 
     Returns
     -------
@@ -91,146 +51,63 @@ def mergeKmerFiles(filename0, filename1, output,
         Output file is written, None is returned
     """
     # generate alignment streams
-    stream0 = alignmentStream(filename0, f0_start, f0_end)
-    stream1 = alignmentStream(filename1, f1_start)
+    if starts is None:
+        starts = [None] * len(files)
+    if ends is None:
+        ends = [None] * len(files)
+    streams = [alignmentStream(filename, start, end)
+               for filename, start, end in zip(files, starts, ends)]
 
     # Take intersection of alignments
-    alignments = intersectSortedStreams(stream0, stream1)
+    alignments = intersectAlignmentStreams(streams)
 
     # Write alignments back to file
     writeAlignmentStream(alignments, output)
 
 
-def mergeKmerSingleCore(filename0, filename1, output):
-    """ Merge two kmer files to output file in parallel
-
-    Parameters
-    ----------
-    filename0 : str
-        Name of first kmer file to merge
-    filename1 : str
-        Name of second kmer file to merge
-    output : str
-        Name of output file to write
-    workdir : str, optional
-        Name of work directory to write temporary files
-
-    Returns
-    -------
-    None
-        Output file is written, None is returned
-    """
-    # Now merge these files together using cat
-    with open(output, "w") as fout:
-        # Merge
-        mergeKmerFiles(filename0, filename1, output)
-        # Return merged filename
-        return output
-
-
-def mergeKmerParallel(filename0, filename1, output,
-                      parallel, workdir=None):
-    """ Merge two kmer files to output file in parallel
-
-    Parameters
-    ----------
-    filename0 : str
-        Name of first kmer file to merge
-    filename1 : str
-        Name of second kmer file to merge
-    output : str
-        Name of output file to write
-    workdir : str, optional
-        Name of work directory to write temporary files
-
-    Returns
-    -------
-    None
-        Output file is written, None is returned
-    """
-    # Start by making a list of temporary files
-    tmp_files = [tmpFile(workdir) for i in range(parallel)]
-
-    # Get the start and end iteration points for filename0
-    f0_start_end = list(splitFilePtrs(filename0, parallel))
-
-    # Find the bisection starting point for filename1
-    f1_start = []
-    with open(filename0) as fptr:
-        for start, end in f0_start_end:
-            # Get line at start
-            fptr.seek(start)
-            line = fptr.readline().split(',')[0]
-
-            # Bisect on line and add pos to other_start
-            pos, line2 = bisect(filename1, line)
-            f1_start.append(pos)
-
-    # Create a list of job args
-    job_args = []
-    for x, y, z in zip(tmp_files, f0_start_end, f1_start):
-        job_args.append((filename0, filename1, x, *y, z))
-
-    # Run jobs in parallel pool
-    with multiprocessing.Pool(parallel) as pool:
-        pool.starmap(mergeKmerFiles, job_args)
-
-    # Now merge these files together using cat
-    with open(output, "w") as fout:
-        # Merge tmp_files into fptr.name
-        for tmp in tmp_files:
-            with open(tmp) as fin:
-                fin.flush()
-                shutil.copyfileobj(fin, fout)
-                fout.flush()
-        # Return merged filename
-        return output
-
-
-def mergeKmerJob(in_queue, out_queue, verbose=True):
-    """ Process job for merging kmer files
+def mergeBucketJob(in_queue, out_queue, workdir=None, verbose=True):
+    """ Process job for merging the kmer files of a single bucket
 
     Parameters
     ----------
     in_queue : Multiprocessing Queue
-        Input queue which holds jobs to run
+        Input queue which holds (bucket, files) jobs to run
     out_queue : Multiprocessing Queue
-        Output queue to put finished jobs
+        Output queue to put (bucket, merged filename) of finished jobs
+    workdir : str, optional
+        Work directory to write temporary files
+    verbose : bool, optional
+        Print progress to stderr
 
     """
     # Get first job and iterate until None is encountered
     job_args = in_queue.get()
     while job_args is not None:
-        # Split into args
-        filename0, filename1, output, parallel, workdir = job_args
-
-        # Print verbosity
-        start_t = None
-        if verbose:
-            message = (f"Merging: {filename0} + {filename1} -> {output} using"
-                       f" {parallel} cores")
-            print(message, file=sys.stderr)
-            start_t = time.time()
+        bucket, files = job_args
 
-        # Merge files
-        # Note that mergeKmerSingleCore is a temporary replacement for mergeKmerParallel which does not produce consistent results currently. See issue 17 on github for more details.
-        #mergeKmerParallel(filename0, filename1, output, parallel, workdir)
-        mergeKmerSingleCore(filename0, filename1, output)
+        # Merge the bucket shards into a single file
+        output = tmpFile(workdir)
+        mergeFiles(list(files), output, 1, workdir, verbose)
 
-        # Print verbosity
-        if verbose:
-            end_t = time.time()
-            end_message = (f"=> Merged {filename0} + {filename1} -> {output}"
-                           f" in {prettyTime(end_t-start_t)}")
-            print(Fore.GREEN + end_message + Style.RESET_ALL, file=sys.stderr)
+        # Shards are no longer needed, remove them to free disk space
+        for filename in files:
+            if os.path.exists(filename):
+                os.remove(filename)
 
         # Add to output queue and get next job
-        out_queue.put(output)
+        out_queue.put((bucket, output))
         job_args = in_queue.get()
 
 
 def mergeFiles(files, output, parallel=1, workdir=None, verbose=True):
-    """ Iteratively merges files until only one file is left
+    """ Merges sorted kmer files into the alignments found in every file
+
+    Files are merged at once with a k-way merge. More files than mergeFanIn
+    allows open at once are first merged in groups, and the results of the
+    groups are then merged in turn. With parallel > 1 the groups are merged
+    in a pool, and the final merge splits the kmers into key ranges at keys
+    sampled from the largest file, every file is bisected at those keys and
+    each range is merged by its own process.
 
     Parameters
     ----------
@@ -250,61 +127,85 @@ def mergeFiles(files, output, parallel=1, workdir=None, verbose=True):
     None
         Output file is written
     """
-    # Iterate through files and merge until only one file remains
-    tmp_files = []
-    counter = 0
-    while len(files) > 1:
-        # Get number of jobs to run and the number of cores per job
-        jobs = len(files) // 2
-        job_cores = []
-        if parallel < jobs:
-            job_cores = [1] * jobs
+    # move a single file to output, a binary kmer file is converted to text
+    # as merged files are always text
+    if len(files) == 1:
+        with open(files[0], "rb") as fin:
+            binary = fin.read(len(RECORD_MAGIC)) == RECORD_MAGIC
+        if binary:
+            with open(output, "wb") as fout:
+                fout.writelines(kmerLines(files[0]))
+            os.remove(files[0])
         else:
-            for i in range(jobs):
-                np = (parallel // jobs) + (i < parallel % jobs)
-                job_cores.append(np)
-
-        # Initialize processors with input and output queue
-        processes = []
-        job_queue = multiprocessing.Queue()
-        fin_queue = multiprocessing.Queue()
-        for i in range(jobs):
-            p = multiprocessing.Process(target=mergeKmerJob,
-                                        args=(job_queue, fin_queue, verbose))
-            p.start()
-            processes.append(p)
-
-        # Get pairs of files to merge
-        file_pairs = []
-        while len(files) > 1:
-            file_pairs.append((files.pop(), files.pop()))
-
-        # Add jobs to queue
-        for f0_f1, np in zip(file_pairs, job_cores):
-            # Create temporary output file
-            tmp_file = tmpFile(workdir)
-
-            # Add job to queue
-            f0, f1 = f0_f1
-            job_queue.put((f0, f1, tmp_file, np, workdir))
-
-        # now wait for jobs to finish and add to output list
-        results = []
-        for p in processes:
-            result = fin_queue.get()
-            results.append(result)
-            tmp_files.append(result)
-
-        # Send kill signal to processes and then join
-        for p in processes:
-            job_queue.put(None)
-
-        # Call join on processes
-        for p in processes:
-            p.join()
-
-        # Set new files to merge
-        files = results + files
-
-    # move result to output
-    shutil.move(files[0], output)
+            shutil.move(files[0], output)
+        return
+
+    # Print verbosity
+    start_t = None
+    input_count = len(files)
+    if verbose:
+        message = (f"Merging: {input_count} files -> {output} using"
+                   f" {parallel} cores")
+        print(message, file=sys.stderr)
+        start_t = time.time()
+
+    # Merge groups of files until few enough are left to open at once, the
+    # intersection doesn't depend on how the files are grouped
+    fan_in = mergeFanIn()
+    grouped = []
+    while len(files) > fan_in:
+        groups = [files[i:i + fan_in] for i in range(0, len(files), fan_in)]
+        tmp_files = [tmpFile(workdir) for group in groups]
+        job_args = list(zip(groups, tmp_files))
+        if parallel > 1:
+            with multiprocessing.Pool(min(parallel, len(job_args))) as pool:
+                pool.starmap(mergeKmerRange, job_args)
+        else:
+            for group, tmp in job_args:
+                mergeKmerRange(group, tmp)
+
+        # Intermediate results of the previous round are no longer needed
+        for filename in grouped:
+            os.remove(filename)
+        files = grouped = tmp_files
+
+    # Split into key ranges, which needs seekable files rather than pipes
+    pivots = []
+    if parallel > 1 and all(os.path.isfile(f) for f in files):
+        largest = max(files, key=os.path.getsize)
+        pivots = sampleKmerKeys(largest, parallel - 1)
+
+    if len(pivots) == 0:
+        # Merge all files in a single pass
+        mergeKmerRange(list(files), output)
+    else:
+        # Get the start and end byte of every range in each file
+        offsets = [[0] + [kmerFileOffset(f, key) for key in pivots] + [None]
+                   for f in files]
+        tmp_files = [tmpFile(workdir) for i in range(len(pivots) + 1)]
+        job_args = []
+        for i, tmp in enumerate(tmp_files):
+            starts = [o[i] for o in offsets]
+            ends = [o[i + 1] for o in offsets]
+            job_args.append((list(files), tmp, starts, ends))
+
+        # Run jobs in parallel pool, ranges are split at sampled keys so they
+        # are of similar size and each gets its own process
+        with multiprocessing.Pool(len(job_args)) as pool:
+            pool.starmap(mergeKmerRange, job_args)
+
+        # Ranges are in key order, so concatenate them
+        with open(output, "w") as fout:
+            for tmp in tmp_files:
+                with open(tmp) as fin:
+                    shutil.copyfileobj(fin, fout)
+                os.remove(tmp)
+    for filename in grouped:
+        os.remove(filename)
+
+    # Print verbosity
+    if verbose:
+        end_t = time.time()
+        end_message = (f"=> Merged {input_count} files -> {output}"
+                       f" in {prettyTime(end_t-start_t)}")
+        print(Fore.GREEN + end_message + Style.RESET_ALL, file=sys.stderr)
@@ -0,0 +1,219 @@
+import bz2
+import gzip
+import numpy as np
+from ..kstream.kstream import COMP_MAP
+
+
+# Complement of every ASCII code, characters without a complement map to
+# themselves
+COMPLEMENT = np.arange(256, dtype=np.uint8)
+for base, comp in COMP_MAP.items():
+    COMPLEMENT[ord(base)] = ord(comp)
+
+# ASCII codes with DNA mapped back to RNA
+TO_RNA = np.arange(256, dtype=np.uint8)
+TO_RNA[ord('T')] = ord('U')
+TO_RNA[ord('t')] = ord('u')
+
+# Number of kmers laid out into rows at once
+KMER_CHUNK = 1 << 16
+
+
+def _codes(chars):
+    """ Return the ASCII codes of a bytes object as an array """
+    return np.frombuffer(chars, dtype=np.uint8)
+
+
+def readSequences(filename):
+    """ Read the sequences of a fasta file, or one sequence per line
+
+    Sequences are parsed the same way as kstream does: if the first line
+    contains a '>' the file is read as fasta, otherwise every line is a
+    sequence. Files ending in .gz or .bz2 are decompressed.
+
+    Parameters
+    ----------
+    filename : str
+        The file to read
+
+    Yields
+    ------
+    numpy.ndarray of uint8
+        The ASCII codes of each sequence
+
+    """
+    # Open compressed files the same way as fileinput.hook_compressed
+    if filename.endswith(".gz"):
+        fptr = gzip.open(filename, "rb")
+    elif filename.endswith(".bz2"):
+        fptr = bz2.open(filename, "rb")
+    else:
+        fptr = open(filename, "rb")
+
+    with fptr:
+        lines = (line.strip() for line in fptr)
+        first = next(lines, None)
+        if first is None:
+            return
+
+        if b'>' not in first:
+            # Every non-empty line is a sequence
+            for line in (first, *lines):
+                if len(line):
+                    yield np.frombuffer(line, dtype=np.uint8)
+            return
+
+        # Join the lines between fasta headers
+        parts = []
+        for line in lines:
+            if line.startswith(b'>'):
+                if len(parts):
+                    yield np.frombuffer(b''.join(parts), dtype=np.uint8)
+                parts = []
+            elif len(line):
+                parts.append(line)
+        if len(parts):
+            yield np.frombuffer(b''.join(parts), dtype=np.uint8)
+
+
+def splitLayout(length, split):
+    """ Return the columns kstream's split produces for kmers of a length
+
+    Parameters
+    ----------
+    length : int
+        The kmer length
+    split : [int]
+        The split positions, as passed to kstream
+
+    Returns
+    -------
+    list of (int, int)
+        The start and end position in the kmer of every column
+
+    """
+    # Follow kstream._split on kmer positions rather than bases
+    positions = list(range(length))
+    pos_parts = []
+    neg_parts = []
+    for size in split:
+        if size >= 0:
+            pos_parts.append(positions[:size])
+            positions = positions[size:]
+        else:
+            neg_parts.append(positions[size:])
+            positions = positions[:size]
+
+    # Columns are contiguous, so store them as start, end pairs
+    layout = []
+    start = 0
+    for part in pos_parts + [positions] + neg_parts:
+        layout.append((start, start + len(part)))
+        start += len(part)
+    return layout
+
+
+def extractKmerRows(sequences, length, split, omit=True, disallow=b"Nn"):
+    """ Extract split kmers and their reverse complements from sequences
+
+    This produces the same kmer lines as kstream with the complements,
+    disallow, split and omitsoft (or mapsoft) options, but works on whole
+    sequences with numpy instead of one kmer at a time.
+
+    Parameters
+    ----------
+    sequences : list of numpy.ndarray of uint8
+        The sequences to extract kmers from, as returned by readSequences
+    length : int
+        The kmer length
+    split : [int]
+        The split positions, as passed to kstream
+    omit : bool, optional
+        Omit kmers with soft masked bases, otherwise map them to uppercase
+    disallow : bytes, optional
+        Omit kmers containing any of these characters
+
+    Returns
+    -------
+    numpy.ndarray of uint8
+        A (kmers, line length) array of ASCII kmer lines, without newlines
+
+    """
+    # Detect RNA the way kstream does
+    is_rna = False
+    for seq in sequences:
+        if np.isin(seq, _codes(b"Tt")).any():
+            break
+        if np.isin(seq, _codes(b"Uu")).any():
+            is_rna = True
+            break
+
+    # Find the kmers to keep in every sequence first, so they can be laid
+    # out straight into the rows without holding another copy of them all
+    strands = []
+    for seq in sequences:
+        if len(seq) < length:
+            continue
+
+        # Work on DNA, and optionally on uppercase
+        if is_rna:
+            seq = np.where(seq == ord('U'), ord('T'), seq)
+            seq = np.where(seq == ord('u'), ord('t'), seq).astype(np.uint8)
+        lower = (seq >= ord('a')) & (seq <= ord('z'))
+        if not omit:
+            seq = np.where(lower, seq - 32, seq).astype(np.uint8)
+
+        # Flag bases which may not be in a kmer and count them in every
+        # window, disallowed bases complement to themselves so this holds
+        # for both strands
+        bad = np.isin(seq, _codes(disallow))
+        if omit:
+            bad |= lower
+        counts = np.concatenate([[0], np.cumsum(bad)])
+        keep = counts[length:] == counts[:-length]
+
+        # The reverse complements are the kmers of the reverse complemented
+        # sequence, in reverse order, so complement the sequence only once
+        strands.append((seq, keep))
+        strands.append((COMPLEMENT[seq[::-1]], keep[::-1]))
+
+    # Lay the kmers out as ',' separated columns, a chunk at a time
+    layout = splitLayout(length, split)
+    rows = np.full((sum(int(keep.sum()) for _, keep in strands),
+                    length + len(layout) - 1), ord(','), dtype=np.uint8)
+    window = np.lib.stride_tricks.sliding_window_view
+    row = 0
+    for strand, keep in strands:
+        kmers = window(strand, length)
+        starts = np.flatnonzero(keep)
+        for chunk in range(0, len(starts), KMER_CHUNK):
+            block = kmers[starts[chunk:chunk + KMER_CHUNK]]
+
+            # Map back to RNA
+            if is_rna:
+                block = TO_RNA[block]
+            for i, (start, end) in enumerate(layout):
+                rows[row:row + len(block), start + i:end + i] = block[:, start:end]
+            row += len(block)
+    return rows
+
+
+def readKmerRows(filename):
+    """ Read a file of equal length kmer lines into a byte array
+
+    Parameters
+    ----------
+    filename : str
+        The kmer file to read
+
+    Returns
+    -------
+    numpy.ndarray of uint8
+        A (kmers, line length) array of ASCII kmer lines, without newlines
+
+    """
+    data = np.fromfile(filename, dtype=np.uint8)
+    if len(data) == 0:
+        return data.reshape(0, 0)
+    width = int(np.argmax(data == ord('\n'))) + 1
+    return data.reshape(-1, width)[:, :-1]
@@ -0,0 +1,264 @@
+import numpy as np
+
+
+# ASCII codes of the nucleotides which can be packed, in sort order
+PACKABLE = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+# Binary kmer record files start with this magic, followed by the lengths of
+# the left, diagnostic and right columns and the record size as uint16
+RECORD_MAGIC = b"KRSPKMR\x01"
+RECORD_HEADER_SIZE = 16
+
+# Number of records decoded at once when reading record files, and the
+# number of rows packed at once when sorting and writing them
+RECORD_CHUNK = 1 << 16
+
+
+def _chunks(count):
+    """ Yield slices over count rows, RECORD_CHUNK rows at a time """
+    for start in range(0, count, RECORD_CHUNK):
+        yield slice(start, min(count, start + RECORD_CHUNK))
+
+
+def packColumns(columns):
+    """ Pack columns of equal length nucleotide sequences into 2 bits per base
+
+    Four bases are stored per byte with the first base in the highest bits,
+    so comparing packed rows byte by byte gives the same order as comparing
+    the sequences themselves.
+
+    Parameters
+    ----------
+    columns : numpy.ndarray of uint8
+        A (rows, length) array of ASCII nucleotides
+
+    Returns
+    -------
+    tuple of numpy.ndarray, numpy.ndarray
+        The (rows, ceil(length / 4)) packed uint8 array and a boolean array
+        which is False for rows containing bases other than A, C, G, T
+
+    """
+    # Flag rows containing characters which can't be packed
+    rows, length = columns.shape
+    packable = np.zeros(columns.shape, dtype=bool)
+    for base in PACKABLE:
+        packable |= columns == base
+    packable = packable.all(axis=1)
+
+    # Map A, C, G, T to 0, 1, 2, 3 from their ASCII bits
+    codes = ((columns >> 1) ^ (columns >> 2)) & 3
+
+    # Pad to a multiple of four bases and shift four codes into each byte
+    width = -(-length // 4)
+    padded = np.zeros((rows, width * 4), dtype=np.uint8)
+    padded[:, :length] = codes
+    padded = padded.reshape(rows, width, 4)
+    packed = padded[:, :, 0] << 6
+    packed |= padded[:, :, 1] << 4
+    packed |= padded[:, :, 2] << 2
+    packed |= padded[:, :, 3]
+    return packed, packable
+
+
+def unpackColumns(packed, length):
+    """ Unpack 2 bit packed nucleotides, the inverse of packColumns
+
+    Parameters
+    ----------
+    packed : numpy.ndarray of uint8
+        A (rows, ceil(length / 4)) packed array
+    length : int
+        The number of bases in each row
+
+    Returns
+    -------
+    numpy.ndarray of uint8
+        A (rows, length) array of ASCII nucleotides
+
+    """
+    codes = np.stack([packed >> 6, packed >> 4, packed >> 2, packed], axis=2) & 3
+    return PACKABLE[codes.reshape(len(packed), -1)[:, :length]]
+
+
+def writeKmerRecords(rows, fout, order=None):
+    """ Write split kmer lines as fixed width 2 bit packed records
+
+    Rows are packed a chunk at a time, so no full size copy of them is made
+    on the way.
+
+    Parameters
+    ----------
+    rows : numpy.ndarray of uint8
+        A (rows, line length) array of ASCII left,diagnostic,right kmer lines
+    fout : file object
+        A binary file object to write the header and records to
+    order : numpy.ndarray of int, optional
+        The order to write rows in, default writes them as they are
+
+    Returns
+    -------
+    bool
+        False, without writing anything, if the rows can't be packed because
+        they are empty, aren't three columns or contain bases other than
+        A, C, G, T
+
+    """
+    if len(rows) == 0:
+        return False
+
+    # Get the column lengths from the comma positions in the first row
+    commas = np.flatnonzero(rows[0] == ord(','))
+    if len(commas) != 2:
+        return False
+    lengths = [commas[0], commas[1] - commas[0] - 1, rows.shape[1] - commas[1] - 1]
+
+    # Pack the bases without the commas
+    columns = [slice(None, commas[0]), slice(commas[0] + 1, commas[1]),
+               slice(commas[1] + 1, None)]
+    packed = np.empty((len(rows), -(-sum(lengths) // 4)), dtype=np.uint8)
+    for chunk in _chunks(len(rows)):
+        selected = rows[chunk] if order is None else rows[order[chunk]]
+        packed[chunk], packable = packColumns(np.concatenate(
+            [selected[:, column] for column in columns], axis=1))
+        if not packable.all():
+            return False
+
+    # Write the header and then all records at once
+    header = np.array(lengths + [packed.shape[1]], dtype="<u2")
+    fout.write(RECORD_MAGIC + header.tobytes())
+    fout.write(packed.data)
+    return True
+
+
+def recordSize(header):
+    """ Return the size in bytes of the records of a binary kmer file
+
+    Parameters
+    ----------
+    header : bytes
+        The header read from the start of the file
+
+    Returns
+    -------
+    int
+        The size of each record
+
+    """
+    return int(np.frombuffer(header[len(RECORD_MAGIC):], "<u2")[3])
+
+
+def readKmerRecords(fptr, header, limit=None):
+    """ Read the records of a binary kmer file back as text kmer lines
+
+    Parameters
+    ----------
+    fptr : file object
+        A binary file object positioned at a record, may be a pipe
+    header : bytes
+        The header read from the start of the file
+    limit : int, optional
+        The maximum number of records to read, default reads to the end
+
+    Yields
+    ------
+    bytes
+        The left,diagnostic,right kmer lines, in file order
+
+    """
+    left, diag, right, size = np.frombuffer(header[len(RECORD_MAGIC):],
+                                            "<u2").tolist()
+    length = left + diag + right
+    commas = [left, left + diag]
+    while limit is None or limit > 0:
+        count = RECORD_CHUNK if limit is None else min(limit, RECORD_CHUNK)
+        data = fptr.read(count * size)
+        if not data:
+            return
+        if limit is not None:
+            limit -= len(data) // size
+        packed = np.frombuffer(data, dtype=np.uint8).reshape(-1, size)
+
+        # Unpack and put the commas and newlines back
+        bases = unpackColumns(packed, length)
+        lines = np.insert(bases, commas, ord(','), axis=1)
+        lines = np.insert(lines, lines.shape[1], ord('\n'), axis=1)
+        yield from lines.tobytes().splitlines(True)
+
+
+def bucketIndices(rows, boundaries):
+    """ Return the range bucket of every split kmer line at once
+
+    The vectorized form of shared.bucketIndex, comparing the first column of
+    all rows with the bucket boundaries in a single binary search.
+
+    Parameters
+    ----------
+    rows : numpy.ndarray of uint8
+        A (rows, line length) array of ASCII kmer lines, without newlines
+    boundaries : list of str
+        Bucket boundaries as returned by shared.bucketBoundaries
+
+    Returns
+    -------
+    numpy.ndarray of int
+        The index of the bucket holding each row
+
+    """
+    if len(rows) == 0 or len(boundaries) == 0:
+        return np.zeros(len(rows), dtype=np.intp)
+
+    # Compare first columns as fixed width byte strings
+    commas = np.flatnonzero(rows[0] == ord(','))
+    width = commas[0] if len(commas) else rows.shape[1]
+    keys = np.ascontiguousarray(rows[:, :width]).view(f"S{width}").ravel()
+    bounds = np.array([b.encode() for b in boundaries])
+    return np.searchsorted(bounds, keys, side="right")
+
+
+def kmerOrder(rows):
+    """ Return the order which sorts rows of split kmer lines
+
+    Rows are ordered the same way as `LC_ALL=C sort -t, -k1,1 -k3,3`, i.e.
+    on the first and third column with ties broken on the whole line. All
+    rows must share the same column layout, as produced by kstream's split.
+    Keys are 2 bit packed when every base is A, C, G or T, otherwise the
+    ASCII columns are compared directly.
+
+    Parameters
+    ----------
+    rows : numpy.ndarray of uint8
+        A (rows, line length) array of ASCII kmer lines, without newlines
+
+    Returns
+    -------
+    numpy.ndarray of int
+        Indices which sort the rows
+
+    """
+    if len(rows) == 0:
+        return np.arange(0)
+
+    # Find the columns from the comma positions in the first row
+    line_len = rows.shape[1]
+    commas = list(np.flatnonzero(rows[0] == ord(',')))
+    bounds = zip([-1] + commas, commas + [line_len])
+    columns = [rows[:, start + 1:end] for start, end in bounds]
+
+    # Sort on the first and third column, then on the rest of the line
+    columns = [columns[0], columns[2]] + columns[1:2] + columns[3:]
+
+    # Pack the key a chunk at a time rather than copying it whole first
+    width = sum(column.shape[1] for column in columns)
+    key = np.empty((len(rows), -(-width // 4)), dtype=np.uint8)
+    for chunk in _chunks(len(rows)):
+        key[chunk], packable = packColumns(np.concatenate(
+            [column[chunk] for column in columns], axis=1))
+        if not packable.all():
+            key = np.concatenate(columns, axis=1)
+            break
+
+    # Compare whole keys as fixed width byte strings
+    key = np.ascontiguousarray(key).view(f"S{key.shape[1]}").ravel()
+    return np.argsort(key, kind="stable")
+
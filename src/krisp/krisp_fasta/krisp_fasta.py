@@ -1,21 +1,155 @@
 #! /bin/env python3
+import os
 import sys
 import argparse
 import time
 import multiprocessing
+import queue
+import shutil
+import stat
 import subprocess
 from ..kstream import kstream
-from .intersectAmplicons import mergeFiles
+from ..kstream.kstream import sortFile
+from .intersectAmplicons import mergeFiles, mergeBucketJob
 from .outputAlignments import render_output
 from .shared import *
 from colorama import Fore, Back, Style
 from .filterAlignments import filterAlignments
+from .kmerPacking import kmerOrder, writeKmerRecords, bucketIndices, RECORD_CHUNK
+from .kmerExtraction import extractKmerRows, readKmerRows, readSequences
 from .Amplicon import ConservedEndAmplicons
+import numpy as np
+
+
+# Approximate per kmer memory of an in-memory sort on top of its sequence
+KMER_OVERHEAD_BYTES = 64
+
+def writeSortedKmers(rows, output):
+    """ Sort kmer rows in memory on 2 bit packed keys and write them to output
+
+    Kmers are written as binary 2 bit packed records (see writeKmerRecords)
+    when every base can be packed, otherwise as text lines.
+
+    Parameters
+    ----------
+    rows : numpy.ndarray of uint8
+        A (kmers, line length) array of ASCII kmer lines, without newlines
+    output : str
+        Name of the file to write sorted kmers to
+
+    Returns
+    -------
+    int
+        The number of kmers written
+    """
+    order = kmerOrder(rows)
+
+    # Write kmers in sort order a chunk at a time rather than sorting a copy
+    # of them, output may be a named pipe so don't use tofile
+    with open(output, "wb") as fout:
+        if not writeKmerRecords(rows, fout, order):
+            # Add a newline to every row
+            for start in range(0, len(order), RECORD_CHUNK):
+                chunk = order[start:start + RECORD_CHUNK]
+                lines = np.empty((len(chunk), rows.shape[1] + 1), dtype=np.uint8)
+                lines[:, :-1] = rows[chunk]
+                lines[:, -1] = ord('\n')
+                fout.write(lines.data)
+    return len(rows)
+
+
+def estimateBases(fasta):
+    """ Estimate the number of bases in a fasta file without reading it
+
+    Parameters
+    ----------
+    fasta : str
+        Fasta file, optionally gzip or bzip2 compressed
+
+    Returns
+    -------
+    int
+        Approximate number of bases, assuming one base per byte
+    """
+    size = os.path.getsize(fasta)
+    if fasta.endswith(".gz"):
+        # The gzip trailer holds the uncompressed size modulo 2**32. It only
+        # covers the last member of multi-member files (e.g. bgzip) and wraps
+        # for large files, so fall back to a typical compression ratio when
+        # it is smaller than the compressed file
+        with open(fasta, "rb") as fptr:
+            fptr.seek(max(0, size - 4))
+            isize = int.from_bytes(fptr.read(4), "little")
+        return isize if isize >= size else size * 4
+    if fasta.endswith(".bz2"):
+        return size * 4
+    return size
+
+
+def sortMemoryShares(files, parallel, total=80):
+    """ Split a percentage of memory between sort jobs by file size
+
+    Jobs run largest first with at most parallel at once, so the largest
+    concurrent jobs bound the memory in use. Every job gets at least 1% and
+    its size's share of the rest, which keeps any set of running jobs within
+    total.
+
+    Parameters
+    ----------
+    files : [str, str, ...]
+        Fasta files which are sorted, parallel at a time
+    parallel : int
+        Number of jobs running at once
+    total : int, optional
+        Percentage of memory to split between running jobs
+
+    Returns
+    -------
+    list of str
+        Sort memory of each file, see linux sort '-S'
+    """
+    sizes = [estimateBases(f) for f in files]
+    running = sorted(sizes, reverse=True)[:parallel]
+    rest = max(0, total - len(running))
+    return [f"{1 + rest * size // max(1, sum(running))}%" for size in sizes]
+
+
+def estimateSortBytes(fasta, ampl_len):
+    """ Estimate the memory needed to sort the kmers of a fasta file in memory
+
+    Parameters
+    ----------
+    fasta : str
+        Fasta file kmers are extracted from
+    ampl_len : int
+        Total amplicon length
+
+    Returns
+    -------
+    int
+        Approximate number of bytes used by sorting in memory
+    """
+    bases = estimateBases(fasta)
+
+    # Every base starts a kmer on each strand, each held as a row of bytes.
+    # Sorting adds a key of up to another row per kmer, the sort order and
+    # the chunks being packed, which the rest of the bound covers
+    return 2 * bases * (3 * ampl_len + KMER_OVERHEAD_BYTES)
 
 
 def extractSortedKmers(fasta, primer_left, primer_right, ampl_len, output,
-                       sortmem, parallel=1, verbose=True, omit=True):
-    """  Fastafile -> kmers written to output file """
+                       sortmem, parallel=1, verbose=True, omit=True,
+                       in_memory_threshold_bytes=0, sort_compress=None):
+    """  Fastafile -> kmers written to output file
+
+    If the kmers are estimated to fit in in_memory_threshold_bytes they are
+    extracted with numpy and sorted in memory on 2 bit packed keys,
+    otherwise kstream and the external sort utility are used, compressing
+    its temporary files with the sort_compress program if given.
+    """
+    in_memory = (estimateSortBytes(fasta, ampl_len) <
+                 in_memory_threshold_bytes)
+
     # Get kmers from the fasta file
     if omit:
         kmers = kstream(fasta,
@@ -28,6 +162,7 @@ def extractSortedKmers(fasta, primer_left, primer_right, ampl_len, output,
                         sortmem=sortmem,
                         sortcols=[0, 2],
                         sortnp=parallel,
+                        sortcompress=sort_compress,
                         parallel=parallel)
     else:
         kmers = kstream(fasta,
@@ -40,6 +175,7 @@ def extractSortedKmers(fasta, primer_left, primer_right, ampl_len, output,
                         sortmem=sortmem,
                         sortcols=[0, 2],
                         sortnp=parallel,
+                        sortcompress=sort_compress,
                         parallel=parallel)
 
 
@@ -54,7 +190,12 @@ def extractSortedKmers(fasta, primer_left, primer_right, ampl_len, output,
         print(message, end='\n', file=sys.stderr)
 
         # Write kmers and get count
-        found = kmers.write(output)
+        if in_memory:
+            rows = extractKmerRows(list(readSequences(fasta)), ampl_len,
+                                   [primer_left, -primer_right], omit)
+            found = writeSortedKmers(rows, output)
+        else:
+            found = kmers.write(output)
 
         # Print end message
         end_t = time.time()
@@ -63,65 +204,374 @@ def extractSortedKmers(fasta, primer_left, primer_right, ampl_len, output,
         print(Fore.GREEN + end_message + Style.RESET_ALL, file=sys.stderr)
     else:
         # Write kmers
-        kmers.write(output)
+        if in_memory:
+            rows = extractKmerRows(list(readSequences(fasta)), ampl_len,
+                                   [primer_left, -primer_right], omit)
+            writeSortedKmers(rows, output)
+        else:
+            kmers.write(output)
+
+
+def _routeSortedKmerBuckets(fasta, primer_left, primer_right, ampl_len,
+                            outputs, boundaries, sortmem, parallel, omit,
+                            ready, in_memory, pipes, sort_compress):
+    """ Helper for extractSortedKmerBuckets which streams kmers from kstream
+
+    Kmers are routed to an unsorted file per bucket, then every bucket is
+    sorted in memory or with the sort utility. Returns the number of kmers.
+    """
+    # Get unsorted kmers from the fasta file
+    soft = {"omitsoft": True} if omit else {"mapsoft": True}
+    kmers = kstream(fasta,
+                    kmers=ampl_len,
+                    disallow="Nn",
+                    complements=True,
+                    split=[primer_left, -primer_right],
+                    **soft)
+
+    # Route every kmer into the file of its bucket
+    unsorted = [f"{output}.unsorted" for output in outputs] if pipes else outputs
+    fouts = [open(filename, "w") for filename in unsorted]
+    found = 0
+    try:
+        for kmer in kmers:
+            print(kmer, file=fouts[bucketIndex(kmer, boundaries)])
+            found += 1
+    finally:
+        for fout in fouts:
+            fout.close()
+
+    # Sort buckets in key order and announce each one when it is ready
+    for filename, output in zip(unsorted, outputs):
+        # Writing to a pipe blocks until the merge opens it, so announce first
+        if pipes and ready is not None:
+            ready.put(output)
+        if in_memory:
+            writeSortedKmers(readKmerRows(filename), output)
+        else:
+            sortFile(filename, output, np=parallel, mem=sortmem, cols=[0, 2],
+                     compress=sort_compress)
+        if pipes:
+            os.remove(filename)
+        elif ready is not None:
+            ready.put(output)
+
+    return found
+
+
+def extractSortedKmerBuckets(fasta, primer_left, primer_right, ampl_len,
+                             outputs, sortmem, parallel=1, verbose=True,
+                             omit=True, ready=None,
+                             in_memory_threshold_bytes=0, pipes=False,
+                             sort_compress=None):
+    """ Fastafile -> kmers split into sorted range buckets
+
+    Kmers are routed into one file per bucket (see bucketBoundaries) and each
+    bucket is then sorted on its own. If all kmers of the file fit in
+    in_memory_threshold_bytes they are instead extracted, routed and sorted
+    in memory with numpy. As soon as a bucket is sorted its filename is put
+    on the ready queue, so downstream merging can start before the remaining
+    buckets of this file are done. If pipes is True the
+    outputs are named pipes: a bucket is announced before it is sorted and
+    the sorted kmers are streamed straight to the merge reading the pipe.
+
+    Parameters
+    ----------
+    fasta : str
+        Fasta file to extract kmers from
+    primer_left : int
+        Length of the conserved region on the left of the amplicon
+    primer_right : int
+        Length of the conserved region on the right of the amplicon
+    ampl_len : int
+        Total amplicon length
+    outputs : [str, str, ...]
+        Output filename of every bucket, in bucket order
+    sortmem : str
+        The amount of memory to use when sorting a bucket
+    parallel : int, optional
+        Number of cores used for sorting
+    verbose : bool, optional
+        Print progress to stderr
+    omit : bool, optional
+        Omit softmasked nucleotides rather than mapping them to uppercase
+    ready : Queue, optional
+        Queue to put the filename of each bucket on once it is sorted
+    in_memory_threshold_bytes : int, optional
+        Sort buckets in memory if they are estimated to fit in this many bytes
+    pipes : bool, optional
+        The outputs are named pipes read by the merge
+    sort_compress : str, optional
+        Program the sort utility compresses temporary files with
+
+    """
+    # Print start message
+    if verbose:
+        start_t = time.time()
+        message = (f"Extracting {ampl_len}-mers from {fasta} "
+                   f"into {len(outputs)} buckets")
+        print(message, end='\n', file=sys.stderr)
+
+    estimate = estimateSortBytes(fasta, ampl_len)
+    boundaries = bucketBoundaries(len(outputs))
+    if estimate < in_memory_threshold_bytes:
+        # Route all kmers to their buckets at once and sort each in memory
+        rows = extractKmerRows(list(readSequences(fasta)), ampl_len,
+                               [primer_left, -primer_right], omit)
+        buckets = bucketIndices(rows, boundaries)
+        order = np.argsort(buckets, kind="stable")
+        splits = np.searchsorted(buckets[order], np.arange(1, len(outputs)))
+        found = len(rows)
+        for bucket_rows, output in zip(np.split(rows[order], splits), outputs):
+            # Writing to a pipe blocks until the merge opens it
+            if pipes and ready is not None:
+                ready.put(output)
+            writeSortedKmers(bucket_rows, output)
+            if not pipes and ready is not None:
+                ready.put(output)
+    else:
+        found = _routeSortedKmerBuckets(fasta, primer_left, primer_right,
+                                        ampl_len, outputs, boundaries, sortmem,
+                                        parallel, omit, ready,
+                                        estimate // len(outputs) <
+                                        in_memory_threshold_bytes,
+                                        pipes, sort_compress)
+
+    # Print end message
+    if verbose:
+        end_t = time.time()
+        end_message = (f"=> Extracted and sorted {found:,} {ampl_len}-kmers"
+                       f" from {fasta} in {prettyTime(end_t-start_t)}")
+        print(Fore.GREEN + end_message + Style.RESET_ALL, file=sys.stderr)
+
+
+def _warmup():
+    """ Pool initializer which imports the extraction modules once per worker """
+    from ..kstream import kstream  # noqa: F401
+    from . import kmerExtraction, kmerPacking, shared  # noqa: F401
+
+
+def _extractionPool(parallel):
+    """ Create a pool of long lived workers for kmer extraction
+
+    Workers are forked where possible so they start with the parent's
+    modules already imported, and are kept for the whole batch.
+    """
+    ctx = multiprocessing.get_context("fork" if sys.platform != "win32" else "spawn")
+    return ctx.Pool(parallel, initializer=_warmup, maxtasksperchild=None)
 
 
-def sortedKmerJob(input_queue):
-    """ Process job which calls kmerjob on args in queue """
-    args = input_queue.get()
-    while args is not None:
-        # run job
-        extractSortedKmers(*args)
-        args = input_queue.get()
+def _run_extract(args):
+    """ Pool job which calls extractSortedKmers on a tuple of args """
+    extractSortedKmers(*args)
 
 
 def sortedKmersSerial(files, outputs, ampl_len, primer_left, primer_right,
-                      verbose=True, omit=True):
+                      verbose=True, omit=True, in_memory_threshold_bytes=0,
+                      sort_compress=None):
    for filename, outfile in zip(files, outputs):
         # Call base function to extract and sort args
         extractSortedKmers(filename, primer_left, primer_right, ampl_len,
-                           outfile, "80%", 1, verbose, omit)
+                           outfile, "80%", 1, verbose, omit,
+                           in_memory_threshold_bytes, sort_compress)
 
 
 def sortedKmersParallel(files, outputs, ampl_len, primer_left, primer_right,
-                        parallel=1, verbose=True, omit=True):
+                        parallel=1, verbose=True, omit=True,
+                        in_memory_threshold_bytes=0, sort_compress=None):
     """ Coverts a batch of files into sorted kmer files """
-    # Determine the number of cores to give to each job
-    job_cores = []
-    jobs = len(files)
-    if parallel < jobs:
-        job_cores = [1] * jobs
-    else:
-        for i, f in enumerate(files):
-            np = (parallel // jobs) + (i < parallel % jobs)
-            job_cores.append(np)
-
-    # First add jobs to a multiprocessing queue
-    job_queue = multiprocessing.Queue()
-    sortmem = f"{80//len(job_cores)}%"
-    for filename, outfile, cores in zip(files, outputs, job_cores):
+    # Each job gets a single core and a share of the sort memory weighted by
+    # its size, parallelism comes from running several files at once
+    sortmems = sortMemoryShares(files, parallel)
+    job_threshold = in_memory_threshold_bytes // parallel
+    args_list = []
+    for filename, outfile, sortmem in zip(files, outputs, sortmems):
         # Get args for finding kmers
         args = (filename, primer_left, primer_right, ampl_len,
-                outfile, sortmem, cores, verbose, omit)
-        # Add args to job queue
-        job_queue.put(args)
-    for i in range(jobs):
-        # Add end signal to job queue
-        job_queue.put(None)
+                outfile, sortmem, 1, verbose, omit, job_threshold,
+                sort_compress)
+        args_list.append(args)
+
+    # Start the largest files first so they don't hold up the end of the batch
+    args_list.sort(key=lambda x: estimateBases(x[0]), reverse=True)
 
-    # Spawn jobs
+    # Run jobs in a pool, idle workers pick up the next file as soon as
+    # they finish their current one. Files can take anywhere from seconds to
+    # hours, so they are handed out one at a time: the default chunksize
+    # would tie several files to one worker and leave it straggling while
+    # the other workers sit idle.
+    with _extractionPool(parallel) as pool:
+        for _ in pool.imap_unordered(_run_extract, args_list, chunksize=1):
+            pass
+
+
+def _run_extract_buckets(args):
+    """ Pool job which calls extractSortedKmerBuckets on a tuple of args """
+    extractSortedKmerBuckets(*args)
+
+
+def _checkBucketJobs(failures, processes):
+    """ Raise the first extraction error or if a merge process has died """
+    if len(failures):
+        raise failures[0]
+    for p in processes:
+        if not p.is_alive():
+            raise RuntimeError(f"Bucket merge process exited with code "
+                               f"{p.exitcode}")
+
+
+def _releasePipes(filenames):
+    """ Open and close the read end of named pipes so blocked writers fail
+
+    A sort writing to a pipe is left blocked in open when its merge is gone,
+    after this it gets a broken pipe and exits.
+    """
+    for filename in filenames:
+        if os.path.exists(filename) and stat.S_ISFIFO(os.stat(filename).st_mode):
+            os.close(os.open(filename, os.O_RDONLY | os.O_NONBLOCK))
+
+
+def sortedKmersBucketed(files, outputs, output, ampl_len, primer_left,
+                        primer_right, buckets, parallel=1, workdir=None,
+                        verbose=True, omit=True, in_memory_threshold_bytes=0,
+                        sort_compress=None):
+    """ Extract, sort and merge kmers with overlapping stages
+
+    Every file is split into range buckets of kmers. Bucket b is merged
+    across all files as soon as every file has produced it, while later
+    buckets are still being sorted. The merged buckets are already in
+    global order, so they are concatenated into the final output.
+
+    Parameters
+    ----------
+    files : [str, str, ...]
+        Fasta files to extract kmers from
+    outputs : [str, str, ...]
+        Base name of the kmer files for each fasta file
+    output : str
+        Output file to write the merged kmers to
+    ampl_len : int
+        Total amplicon length
+    primer_left : int
+        Length of the conserved region on the left of the amplicon
+    primer_right : int
+        Length of the conserved region on the right of the amplicon
+    buckets : int
+        Number of buckets to split the kmers of each file into
+    parallel : int, optional
+        Number of cores to use for extraction and for merging
+    workdir : str, optional
+        Work directory to write temporary files
+    verbose : bool, optional
+        Print progress to stderr
+    omit : bool, optional
+        Omit softmasked nucleotides rather than mapping them to uppercase
+    in_memory_threshold_bytes : int, optional
+        Memory below which buckets are sorted in memory, shared by all jobs
+    sort_compress : str, optional
+        Program the sort utility compresses temporary files with
+
+    Returns
+    -------
+    None
+        Output file is written
+    """
+    # Name the bucket files of every input and remember their bucket
+    shards = [[f"{name}.{b}" for b in range(buckets)] for name in outputs]
+    shard_bucket = {shard: b for names in shards for shard, b in
+                    zip(names, range(buckets))}
+
+    # Stream sorted buckets straight into the merge through named pipes when
+    # every file is extracted at once. Otherwise a merge could wait on a file
+    # which can't start until that merge has read the pipes of other files.
+    pipes = hasattr(os, "mkfifo") and 1 < len(files) <= parallel
+    if pipes:
+        for shard in shard_bucket:
+            os.mkfifo(shard)
+
+    # Start merge processes which wait for complete buckets
+    job_queue = multiprocessing.Queue()
+    fin_queue = multiprocessing.Queue()
     processes = []
-    for i in range(min([parallel, jobs])):
-        # Spawn process
-        p = multiprocessing.Process(target=sortedKmerJob, args=(job_queue,))
-        # Start process and add to process queue
+    for i in range(min(parallel, buckets)):
+        p = multiprocessing.Process(target=mergeBucketJob,
+                                    args=(job_queue, fin_queue, workdir, verbose))
         p.start()
         processes.append(p)
 
-    # Wait for jobs to finish
+    # Extract kmers in a pool, reporting finished buckets on a shared queue.
+    # Failures are checked for while waiting, as with pipes the other files
+    # block on buckets which will never be merged.
+    failures = []
+    try:
+        sortmems = sortMemoryShares(files, parallel)
+        job_threshold = in_memory_threshold_bytes // parallel
+        with multiprocessing.Manager() as manager:
+            ready = manager.Queue()
+            args_list = [(filename, primer_left, primer_right, ampl_len, names,
+                          sortmem, 1, verbose, omit, ready, job_threshold, pipes,
+                          sort_compress)
+                         for filename, names, sortmem
+                         in zip(files, shards, sortmems)]
+            args_list.sort(key=lambda x: estimateBases(x[0]), reverse=True)
+            # One file per task, see sortedKmersParallel
+            with _extractionPool(parallel) as pool:
+                extraction = [pool.apply_async(_run_extract_buckets, (args,),
+                                               error_callback=failures.append)
+                              for args in args_list]
+
+                # Send buckets off to be merged once every file has produced them
+                produced = [0] * buckets
+                remaining = len(files) * buckets
+                while remaining > 0:
+                    try:
+                        shard = ready.get(timeout=1)
+                    except queue.Empty:
+                        _checkBucketJobs(failures, processes)
+                        if all(result.ready() for result in extraction):
+                            raise RuntimeError("Kmer extraction finished with "
+                                               "buckets missing")
+                        continue
+                    remaining -= 1
+                    bucket = shard_bucket[shard]
+                    produced[bucket] += 1
+                    if produced[bucket] == len(files):
+                        job_queue.put((bucket, [names[bucket] for names in shards]))
+                for result in extraction:
+                    result.get()
+
+        # Collect merged buckets
+        merged = [None] * buckets
+        for i in range(buckets):
+            while True:
+                try:
+                    bucket, filename = fin_queue.get(timeout=1)
+                    break
+                except queue.Empty:
+                    _checkBucketJobs(failures, processes)
+            merged[bucket] = filename
+    except BaseException:
+        # Don't leave merge processes or sorts waiting on buckets that won't
+        # come, the extraction pool is terminated when its block exits
+        for p in processes:
+            p.terminate()
+        if pipes:
+            _releasePipes(shard_bucket)
+        raise
+
+    # Stop the merge processes
+    for p in processes:
+        job_queue.put(None)
     for p in processes:
         p.join()
 
+    # Concatenate merged buckets in key order
+    with open(output, "w") as fout:
+        for filename in merged:
+            with open(filename) as fin:
+                shutil.copyfileobj(fin, fout)
+            os.remove(filename)
+
 
 def main():
     """ Parse command line args """
@@ -147,6 +597,12 @@ def main():
                         help="Omit softmasked nucleotides")
     parser.add_argument("--cores", type=int, default=1, metavar='INT',
                         help="Total number of processors to utilize. (default: %(default)s)")
+    parser.add_argument("--buckets", type=int, default=1, metavar='INT',
+                        help="Split kmers into this many key-range buckets so merging can start\nbefore all files are extracted and sorted. (default: %(default)s)")
+    parser.add_argument("--sort-in-memory", type=parseSize, default=0, metavar='SIZE',
+                        help="Sort kmers in memory on 2-bit packed keys when they are estimated to fit in SIZE\n(e.g. 500M, 4G), otherwise use the sort utility. (default: always use sort)")
+    parser.add_argument("--sort-compress", type=str, default=None, metavar='PROGRAM',
+                        help="Compress temporary files of the sort utility with PROGRAM (e.g. zstd, lz4)\nwhen kmers don't fit in its memory. (default: no compression)")
     parser.add_argument("--dot-alignment", action="store_true",
                         help="Output as dot-based alignments")
     parser.add_argument("-o", "--out_align", type=str, metavar='PATH',
@@ -212,8 +668,17 @@ def main():
         parser.print_help(sys.stderr)
         sys.exit(1)            
 
+    # Sort fails on every file if the compression program is missing
+    if args.sort_compress is not None and shutil.which(args.sort_compress) is None:
+        print(f"ERROR: Could not find sort compression program {args.sort_compress}",
+              file=sys.stderr)
+        sys.exit(1)
+
+    # Get the simple names of the ingroup files
+    ingroup_names = [simplename(f) for f in args.files]
+
     # Set output format
-    ConservedEndAmplicons.ENABLE_DOT = args.dot_alignment
+    ConservedEndAmplicons.setDotAlignment(args.dot_alignment)
 
     # Set Primer3 parameters (NOTE: should be passed a different way, but this was easy)
     primer3_arg_names = ('tm', 'gc', 'primer_size', 'amp_size', 'max_sec_tm',
@@ -236,25 +701,32 @@ def main():
 
         # For every file, extract kmers and save to an individual file
         input_files = args.files + args.outgroup
-        kmer_files = []
-        for filename in input_files:
-            kmer_name = (f"{tmpdir}/{basename(Path(filename).name)}"
-                         f".{args.amplicon}mers")
-            kmer_files.append(kmer_name)
-
-        # Get sorted kmers
-        if args.cores > 1:
-            sortedKmersParallel(input_files, kmer_files, args.amplicon,
-                                args.conserved_left, args.conserved_right, args.cores,
-                                verbose=args.verbose, omit=args.omit_soft)
-        else:
-            sortedKmersSerial(input_files, kmer_files, args.amplicon,
-                                args.conserved_left, args.conserved_right,
-                                verbose=args.verbose, omit=args.omit_soft)
+        kmer_files = [f"{tmpdir}/{basename(f)}.{args.amplicon}mers"
+                      for f in input_files]
 
-        # Merge kmer files into a single file
+        # Get sorted kmers and merge kmer files into a single file
         result = f"{tmpdir}/merged_file.txt"
-        mergeFiles(kmer_files, result, args.cores, tmpdir, args.verbose)
+        if args.buckets > 1:
+            sortedKmersBucketed(input_files, kmer_files, result, args.amplicon,
+                                args.conserved_left, args.conserved_right,
+                                args.buckets, args.cores, tmpdir,
+                                verbose=args.verbose, omit=args.omit_soft,
+                                in_memory_threshold_bytes=args.sort_in_memory,
+                                sort_compress=args.sort_compress)
+        else:
+            if args.cores > 1:
+                sortedKmersParallel(input_files, kmer_files, args.amplicon,
+                                    args.conserved_left, args.conserved_right, args.cores,
+                                    verbose=args.verbose, omit=args.omit_soft,
+                                    in_memory_threshold_bytes=args.sort_in_memory,
+                                    sort_compress=args.sort_compress)
+            else:
+                sortedKmersSerial(input_files, kmer_files, args.amplicon,
+                                    args.conserved_left, args.conserved_right,
+                                    verbose=args.verbose, omit=args.omit_soft,
+                                    in_memory_threshold_bytes=args.sort_in_memory,
+                                    sort_compress=args.sort_compress)
+            mergeFiles(kmer_files, result, args.cores, tmpdir, args.verbose)
 
         # Print start of alignment building
         if args.verbose:
@@ -264,7 +736,7 @@ def main():
         # Find diagnostic sets matching this pattern
         if (args.amplicon > args.conserved_left + args.conserved_right):
             # Create a frozen set from ingroup names
-            ingroup_set = frozenset([simplename(f) for f in args.files])
+            ingroup_set = frozenset(ingroup_names)
             # Get filtered alignments
             filtered_result = f"{tmpdir}/filtered.txt"
             filterAlignments(result, filtered_result, ingroup_set)
@@ -280,7 +752,7 @@ def main():
         found = None
         ingroup = None
         if len(args.outgroup):
-            ingroup = [simplename(f) for f in args.files]
+            ingroup = ingroup_names
         found = render_output(result,
                               out_align=args.out_align,
                               out_csv=args.out_csv,
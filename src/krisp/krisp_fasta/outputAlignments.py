@@ -44,24 +44,46 @@ def stream_writer(file_path=None, default_stream=sys.stdout, mode="a"):
         file_handle.close()
 
 
+def _write_block(stream, block):
+    """ Write a block of text encoded at once to the stream's binary buffer
+
+    Text streams encode every write on their own, so the block is encoded
+    in a single call and written to the underlying buffer instead. Newlines
+    are translated as the text layer would, output streams are opened with
+    the default newline handling. Streams without a buffer, e.g.
+    io.StringIO, are written as text.
+    """
+    buffer = getattr(stream, "buffer", None)
+    if buffer is None:
+        stream.write(block)
+        stream.flush()
+        return
+    # Keep anything already written to the text layer in order
+    stream.flush()
+    if os.linesep != '\n':
+        block = block.replace('\n', os.linesep)
+    buffer.write(block.encode(stream.encoding, stream.errors))
+    buffer.flush()
+
+
 def safe_print(alignments, csv_rows, out_align, out_csv, counter, lock, find_primers):
-    """ Function to safely print alignments to the terminal in parallel """
+    """ Function to safely print alignments to the terminal in parallel
+
+    Every block is joined and written with a single write and flush per
+    stream rather than printing and flushing each row.
+    """
+    # Join outside of the lock
+    align_block = ''.join([align + '\n' for align in alignments])
+    csv_block = ''.join([row + '\n' for row in csv_rows])
+
     # Acquire lock
     with lock:
-        # Iterate through alignments and print, increment counter
-        if out_align is not None and out_csv is not None:
-            for align, row in zip(alignments, csv_rows):
-                print(align, file=out_align, flush=True)
-                print(row, file=out_csv, flush=True)
-                counter.value += 1
-        elif out_csv is not None:
-            for row in csv_rows:
-                print(row, file=out_csv, flush=True)
-                counter.value += 1
-        elif out_align is not None:
-            for align in alignments:
-                print(align, file=out_align, flush=True)
-                counter.value += 1
+        # Write blocks and increment counter
+        if out_align is not None:
+            _write_block(out_align, align_block)
+        if out_csv is not None:
+            _write_block(out_csv, csv_block)
+        counter.value += max(len(alignments), len(csv_rows))
 
 
 def render_output_part(kmerfile, out_align, out_csv, counter, lock,
@@ -69,16 +91,17 @@ def render_output_part(kmerfile, out_align, out_csv, counter, lock,
     """ Helper function to render the contents of a part of the kmer file """
     # Get alignment stream
     alignments = alignmentStream(kmerfile, start, end, ingroup)
+    # Run primer3 and keep alignments it finds primers for, chosen once here
+    # rather than checked per alignment (NOTE: ideally this would run on its
+    # own step in krisp.main, not here)
+    if find_primers:
+        alignments = (a for a in alignments if a.find_primers())
     alignments_to_print = []
     row_to_print = []
     print_block_counter = 0
     with stream_writer(out_align, None) as out_align_stream,\
          stream_writer(out_csv, sys.stdout) as out_csv_stream:
         for alignment in alignments:
-            # Run primer3 (NOTE: ideally this would run on its own step in krisp.main, not here)
-            if find_primers:
-                if not alignment.find_primers():
-                    continue
             # Add to alignments list
             if out_align_stream is not None:
                 alignments_to_print.append(alignment.render_alignment())
@@ -129,8 +152,11 @@ def render_output(kmerfile, out_align=None, out_csv=sys.stdout, cores=1, print_b
 
     """
     # Print CSV header if needed
+    # Flush the header so it isn't duplicated into, or written after, the
+    # output of the forked render processes
     with stream_writer(out_csv, sys.stdout, mode="w") as out_csv_stream:
         _render_csv_header(out_csv_stream, primer3=find_primers)
+        out_csv_stream.flush()
 
     # Print alignment header if needed
     if isinstance(out_align, str) and os.path.isfile(out_align):
@@ -1,8 +1,13 @@
 import math
+import bisect
+import functools
+import heapq
 import tempfile
 import itertools
 from pathlib import Path
 from .Amplicon import Amplicon, ConservedEndAmplicons
+from .kmerPacking import (RECORD_MAGIC, RECORD_HEADER_SIZE, readKmerRecords,
+                          recordSize)
 
 
 def prettyTime(time):
@@ -31,6 +36,31 @@ def prettyTime(time):
         return f"{minutes} minute{pl_min} and {seconds} second{pl_sec}"
 
 
+def parseSize(size):
+    """ Converts a memory size such as "500M" or "4G" into bytes.
+
+    Parameters
+    ----------
+    size : str
+        A number of bytes, optionally followed by a K, M, G or T suffix
+
+    Returns
+    -------
+    int
+        The size in bytes
+
+    Raises
+    ------
+    ValueError
+        If size is not a valid memory size
+    """
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    size = size.strip().upper().rstrip("B")
+    if size[-1:] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
 def basename(filename):
     """Return the basename of a compressed fasta file.
 
@@ -55,6 +85,7 @@ def basename(filename):
     return '.'.join(filename)
 
 
+@functools.lru_cache(maxsize=None)
 def simplename(filename):
     """Return the basename of a fasta file with all extensions removed.
 
@@ -207,6 +238,56 @@ def splitFilePtrs(filename, num_sections):
         return pairs
 
 
+def bucketBoundaries(num_buckets):
+    """ Split the kmer key space into lexicographic range buckets.
+
+    The key space is divided on nucleotide prefixes, so that every kmer in
+    bucket i sorts before every kmer in bucket i+1. Merging each bucket on
+    its own and concatenating the results in bucket order therefore gives
+    the same output as merging the complete files.
+
+    Parameters
+    ----------
+    num_buckets : int
+        The number of buckets to split the key space into
+
+    Returns
+    -------
+    list[str]
+        The num_buckets - 1 sorted keys which separate the buckets
+
+    """
+    # Find the shortest prefix length giving at least num_buckets prefixes
+    prefix_len = 0
+    while 4 ** prefix_len < num_buckets:
+        prefix_len += 1
+
+    # Enumerate prefixes in sorted order and pick evenly spaced boundaries
+    prefixes = [''.join(p) for p in itertools.product("ACGT", repeat=prefix_len)]
+    return [prefixes[i * len(prefixes) // num_buckets]
+            for i in range(1, num_buckets)]
+
+
+def bucketIndex(kmer, boundaries):
+    """ Return the bucket a kmer line belongs to.
+
+    Parameters
+    ----------
+    kmer : str
+        A ',' separated kmer line, bucketed on its first column
+
+    boundaries : list[str]
+        Bucket boundaries as returned by bucketBoundaries
+
+    Returns
+    -------
+    int
+        The index of the bucket holding kmer
+
+    """
+    return bisect.bisect_right(boundaries, kmer.split(',', 1)[0])
+
+
 def simplifyStream(stream):
     """ Simplify a stream by merging same sequences
 
@@ -347,6 +428,199 @@ def intersectSortedStreams(stream0, stream1):
     yield from simplifyStream(removeSingletons(merged))
 
 
+def intersectAlignmentStreams(streams):
+    """ Intersect any number of sorted ConservedEndAmplicons streams
+
+    Gives the same alignments as intersecting the streams pairwise with
+    intersectSortedStreams, but reads every stream once using a heap based
+    k-way merge. An alignment is kept if its primer pair is in every stream,
+    merged with the alignments of the other streams in stream order.
+
+    Parameters
+    ----------
+    streams : list of Generator
+        Generators of ConservedEndAmplicons, each sorted by primer pair
+
+    Yields
+    ------
+    ConservedEndAmplicons
+        An iterable of ConservedEndAmplicons
+
+    """
+    # Make sure each stream is simplified, i.e. duplicate elements are merged
+    streams = [simplifyStream(stream) for stream in streams]
+
+    # Merge all streams, keeping stream order for equal primer pairs
+    key = ConservedEndAmplicons.primerPair
+    merged = heapq.merge(*streams, key=key)
+
+    # Keep primer pairs found once in every stream
+    for _, group in itertools.groupby(merged, key=key):
+        alignment, *others = group
+        if len(others) == len(streams) - 1:
+            for other in others:
+                alignment += other
+            yield alignment
+
+
+def kmerLines(filename, start=None, end=None):
+    """ Read the lines of a text or binary record kmer file
+
+    Parameters
+    ----------
+    filename : str
+        Name of kmer file to read, may be a named pipe if start and end
+        are None
+
+    start : int, optional
+        Starting byte of file to read, must be the start of a line or record
+
+    end : int, optional
+        End byte of file to read
+
+    Yields
+    ------
+    bytes
+        The lines of the file, binary records are converted back to text
+
+    """
+    with open(filename, "rb") as fptr:
+        # Read the start of the file to check for a binary record header
+        header = fptr.read(RECORD_HEADER_SIZE)
+        binary = header.startswith(RECORD_MAGIC)
+
+        # Read whole files sequentially, which also works for pipes
+        if start is None and end is None:
+            if binary:
+                yield from readKmerRecords(fptr, header)
+            else:
+                # Lines may be shorter than the header so split it back up
+                yield from (header + fptr.readline()).splitlines(True)
+                yield from fptr
+            return
+
+        # Get start and end bytes, records start after the header
+        if start is None:
+            start = 0
+        if end is None:
+            end = fileSize(fptr)
+        if binary:
+            start = max(start, RECORD_HEADER_SIZE)
+
+        # Move file pointer to start and read until end is reached
+        fptr.seek(start)
+        if binary:
+            size = recordSize(header)
+            yield from readKmerRecords(fptr, header, (end - start) // size)
+        else:
+            while fptr.tell() < end:
+                line = fptr.readline()
+                if not line:
+                    break
+                yield line
+
+
+def _kmerFileIndex(filename):
+    """ Helper to index the lines or records of a kmer file by byte offset
+
+    Returns the file size and a function which, given a byte offset,
+    returns the start and end byte of the first line or record at or after
+    it together with the first column of that line.
+    """
+    with open(filename, "rb") as fptr:
+        header = fptr.read(RECORD_HEADER_SIZE)
+        size = fileSize(fptr)
+
+    if header.startswith(RECORD_MAGIC):
+        # Records have a fixed size after the header
+        record = recordSize(header)
+
+        def lineAt(offset):
+            index = max(0, -(-(offset - RECORD_HEADER_SIZE) // record))
+            start = RECORD_HEADER_SIZE + index * record
+            if start >= size:
+                return size, size, None
+            line = next(kmerLines(filename, start, start + record))
+            return start, start + record, line.split(b',', 1)[0].decode()
+    else:
+        def lineAt(offset):
+            with open(filename, "rb") as fptr:
+                # Move to the start of the next full line
+                if offset > 0:
+                    fptr.seek(offset - 1)
+                    fptr.readline()
+                start = fptr.tell()
+                line = fptr.readline()
+                if not line:
+                    return size, size, None
+                return start, fptr.tell(), line.split(b',', 1)[0].decode()
+    return size, lineAt
+
+
+def kmerFileOffset(filename, key):
+    """ Find the first line or record of a sorted kmer file not before key
+
+    Parameters
+    ----------
+    filename : str
+        Name of the sorted kmer file, text or binary records
+
+    key : str
+        Key to compare the first column of each line with
+
+    Returns
+    -------
+    int
+        Byte offset of the first line whose first column is >= key, or the
+        file size if there is none
+
+    """
+    size, lineAt = _kmerFileIndex(filename)
+
+    # Bisect on byte offsets, lo is always the start of a line before the
+    # answer or the answer itself
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start, end, column = lineAt(mid)
+        if column is not None and start < hi and column < key:
+            lo = end
+        else:
+            hi = mid
+
+    # Step over the few lines left before key
+    start, end, column = lineAt(lo)
+    while column is not None and column < key:
+        start, end, column = lineAt(end)
+    return start
+
+
+def sampleKmerKeys(filename, count):
+    """ Sample the first column of a sorted kmer file at even intervals
+
+    Parameters
+    ----------
+    filename : str
+        Name of the sorted kmer file, text or binary records
+
+    count : int
+        The number of keys to sample
+
+    Returns
+    -------
+    list of str
+        The sorted and distinct keys found
+
+    """
+    size, lineAt = _kmerFileIndex(filename)
+    keys = set()
+    for i in range(1, count + 1):
+        start, end, column = lineAt(i * size // (count + 1))
+        if column is not None:
+            keys.add(column)
+    return sorted(keys)
+
+
 def ampliconStream(filename, start=None, end=None):
     """ Converts a kmer file into a stream of Amplicons
 
@@ -372,24 +646,9 @@ def ampliconStream(filename, start=None, end=None):
         # Get tag from filename
         tag = simplename(filename)
 
-        # Open file for reading
-        with open(filename) as fptr:
-            # Get start and end bytes
-            if start is None:
-                start = 0
-            if end is None:
-                end = fileSize(fptr)
-
-            # Move file pointer to start
-            fptr.seek(start)
-            # Iterate until end is reached
-            while fptr.tell() < end:
-                # Get next line or break
-                line = fptr.readline()
-                if not line:
-                    break
-                # Convert line into an amplicon
-                yield Amplicon.read(line, tag)
+        # Convert lines of the file into amplicons
+        for line in kmerLines(filename, start, end):
+            yield Amplicon.read(line.decode(), tag)
 
     # First get the raw amplicon stream
     stream = helper(filename, start, end)
@@ -4,7 +4,9 @@ import argparse
 import fileinput
 import itertools
 import multiprocessing
+import os
 import subprocess
+import tempfile
 
 
 # Dictionary of Watson-Crick complements for DNA
@@ -42,8 +44,24 @@ IUPAC_BASE = {'R': ['A', 'G'],
               'n': ['a', 'c', 'g', 't']}
 
 
-def sortPipe(np=None, mem=None, cols=None):
-    """ Create a sorting subprocess Pipe
+def sortEnvironment():
+    """ Return the environment to run the sort utility in
+
+    Sorting is always done in the C locale. Kmers are then ordered byte by
+    byte, which is what the merge of sorted kmer files expects as it compares
+    python strings, and is reproducible and much faster than the locale aware
+    ordering of e.g. en_US.UTF-8.
+
+    Returns
+    --------
+    dict
+        The current environment with LC_ALL=C
+    """
+    return dict(os.environ, LC_ALL="C")
+
+
+def sortOptions(np=None, mem=None, cols=None, compress=None):
+    """ Build the options of a linux sort command
 
     Parameters
     ----------
@@ -56,38 +74,131 @@ def sortPipe(np=None, mem=None, cols=None):
     cols : list of int (optional)
         Columns to sort on, assumes 0-indexing and ',' seperating
 
+    compress : str (optional)
+        Program used to compress temporary files when sort spills to disk,
+        e.g. 'zstd' or 'lz4'. See linux sort '--compress-program'
+
     Returns
     --------
-    subprocess Pipe
-        An active subprocess pipe that can be written to and read from
+    list of str
+        The options to add to the sort command
 
     """
-    # Get default values
-    command = f"LC_ALL=C sort"
+    options = []
     if mem is not None:
-        command += f" -S {mem}"
+        options += ["-S", f"{mem}"]
     if np is not None:
-        command += f" --parallel={np}"
+        options += [f"--parallel={np}"]
+    if compress is not None:
+        options += [f"--compress-program={compress}"]
     if (cols is not None):
-        command += f" -t,"
+        options += ["-t,"]
         for c in cols:
-            command += f" -k{c+1},{c+1}"
+            options += [f"-k{c+1},{c+1}"]
+    return options
+
+
+def sortPipe(np=None, mem=None, cols=None, compress=None):
+    """ Create a sorting subprocess Pipe
+
+    Parameters
+    ----------
+    np : int (optional)
+        The number of cores to use for sorting
+
+    mem : str (optional)
+        The amount of memory to use during sorting. See linux sort '-S'
+
+    cols : list of int (optional)
+        Columns to sort on, assumes 0-indexing and ',' seperating
+
+    compress : str (optional)
+        Program used to compress temporary sort files, see sortOptions
+
+    Returns
+    --------
+    subprocess Pipe
+        An active subprocess pipe that can be written to and read from
+
+    """
+    # Get default values
+    command = ["sort"] + sortOptions(np, mem, cols, compress)
     # Start subprocess and return
     return subprocess.Popen(command,
                             stdin=subprocess.PIPE,
                             stdout=subprocess.PIPE,
                             text=True,
-                            shell=True)
+                            env=sortEnvironment())
 
 
-def sortInPlace(filename, np=None, mem=None, cols=None):
-    """ Sorts a file in place
+def writeSortInput(process, lines=(), close=False):
+    """ Write lines to the input of a sortPipe
+
+    Parameters
+    ----------
+    process : subprocess Pipe
+        A pipe returned by sortPipe
+    lines : iterable of str (optional)
+        The lines to write, without newlines
+    close : bool (optional)
+        Close the input after writing, so sort can start writing output
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If sort has exited with an error, rather than the broken pipe
+
+    """
+    try:
+        for line in lines:
+            print(f"{line}", file=process.stdin)
+        if close:
+            process.stdin.close()
+    except BrokenPipeError:
+        # Drop the unwritten input, sort's exit status tells why it stopped
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        process.stdout.close()
+        raise subprocess.CalledProcessError(process.wait(), process.args) from None
+
+
+def sortedLines(process):
+    """ Read the sorted lines of a sortPipe once its input is closed
+
+    Parameters
+    ----------
+    process : subprocess Pipe
+        A pipe returned by sortPipe
+
+    Yields
+    ------
+    str
+        The sorted lines, stripped of whitespace
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If sort fails, e.g. when its compress program fails
+
+    """
+    yield from (line.strip() for line in process.stdout)
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+
+def sortFile(filename, output, np=None, mem=None, cols=None, compress=None):
+    """ Sorts a file into an output file
 
     Parameters
     ----------
     filename : str
         The file to sort
 
+    output : str
+        The file to write sorted lines to, may be filename or a named pipe
+
     np : int (optional)
         The number of cores to use for sorting
 
@@ -97,26 +208,71 @@ def sortInPlace(filename, np=None, mem=None, cols=None):
     cols : list of int (optional)
         Columns to sort on, assumes 0-indexing and ',' seperating
 
+    compress : str (optional)
+        Program used to compress temporary sort files, see sortOptions
+
     Returns
     --------
     None
-        The input file is sorted in place
+        The sorted lines are written to output
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If sort fails, output is then missing or incomplete
 
     """
 
     # Get default values
-    command = f"LC_ALL=C sort {filename} -o {filename}"
-    if mem is not None:
-        command += f" -S {mem}"
-    if np is not None:
-        command += f" --parallel={np}"
-    if (cols is not None):
-        command += f" -t,"
-        for c in cols:
-            command += f" -k{c+1},{c+1}"
+    command = ["sort", filename, "-o", output]
+    command += sortOptions(np, mem, cols, compress)
     # Run subprocess
-    process = subprocess.Popen(command, shell=True)
-    process.wait()
+    subprocess.run(command, env=sortEnvironment(), check=True)
+
+
+def sortInPlace(filename, np=None, mem=None, cols=None, compress=None):
+    """ Sorts a file in place
+
+    Parameters
+    ----------
+    filename : str
+        The file to sort
+
+    np : int (optional)
+        The number of cores to use for sorting
+
+    mem : str (optional)
+        The amount of memory to use during sorting. See linux sort '-S'
+
+    cols : list of int (optional)
+        Columns to sort on, assumes 0-indexing and ',' seperating
+
+    compress : str (optional)
+        Program used to compress temporary sort files, see sortOptions
+
+    Returns
+    --------
+    None
+        The input file is sorted in place
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If sort fails, the input file is then left unchanged
+
+    """
+    # Sort truncates its output before it can fail, e.g. when the compress
+    # program fails, so sort next to the file and only replace it on success
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                               prefix=f".{os.path.basename(filename)}.")
+    os.close(fd)
+    try:
+        sortFile(filename, tmp, np=np, mem=mem, cols=cols, compress=compress)
+        os.chmod(tmp, os.stat(filename).st_mode)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
 
 
 class kstream:
@@ -130,7 +286,8 @@ class kstream:
     def __init__(self, sequences=None, kmers=None, complements=False,
                  canonicals=False, allow=None, disallow=None, omitsoft=False,
                  mapsoft=False, expandiupac=False, split=None, sort=False,
-                 sortmem=None, sortcols=None, sortnp=1, parallel=1):
+                 sortmem=None, sortcols=None, sortnp=1, sortcompress=None,
+                 parallel=1):
         """
         Parameters
         ----------
@@ -183,6 +340,11 @@ class kstream:
         sortnp : int
             Number of cores to dedicate to sorting
 
+        sortcompress : str
+            Program the sort utility uses to compress temporary files when
+            the kmers don't fit in sortmem, e.g. "zstd". Saves disk space and
+            I/O on large inputs.
+
         parallel : int
             Number of cores to dedicate to kmer extraction
 
@@ -240,6 +402,7 @@ class kstream:
             self.sortnp = sortnp
             self.sortmem = sortmem
             self.sortcols = sortcols
+            self.sortcompress = sortcompress
 
         # Set parallel flag
         self.parallel = parallel
@@ -319,7 +482,8 @@ class kstream:
             sortInPlace(filename,
                         np=self.sortnp,
                         mem=self.sortmem,
-                        cols=self.sortcols)
+                        cols=self.sortcols,
+                        compress=self.sortcompress)
 
         # Return number of kmers found
         return count
@@ -360,14 +524,13 @@ class kstream:
                 # Create sort pipe
                 sort_pipe = sortPipe(np=self.sortnp,
                                      mem=self.sortmem,
-                                     cols=self.sortcols)
+                                     cols=self.sortcols,
+                                     compress=self.sortcompress)
                 # Write sequences to sort
-                for seq in sequences:
-                    print(f"{seq}", file=sort_pipe.stdin)
-                sort_pipe.stdin.close()
+                writeSortInput(sort_pipe, sequences, close=True)
 
                 # set values back into sequences
-                sequences = (line.strip() for line in sort_pipe.stdout)
+                sequences = sortedLines(sort_pipe)
 
             # Map back to RNA
             if is_rna:
@@ -381,7 +544,8 @@ class kstream:
             if self.sort:
                 sort_pipe = sortPipe(np=self.sortnp,
                                      mem=self.sortmem,
-                                     cols=self.sortcols)
+                                     cols=self.sortcols,
+                                     compress=self.sortcompress)
             with multiprocessing.Pool(self.parallel) as pool:
                 # Parse sequences using pools imap, results is a nested list
                 for result in pool.imap_unordered(self._parallel_job,
@@ -394,15 +558,14 @@ class kstream:
                     # Check if sort
                     if self.sort:
                         # Write sequences to sort
-                        for seq in result:
-                            print(f"{seq}", file=sort_pipe.stdin)
+                        writeSortInput(sort_pipe, result)
                     else:
                         yield from result
             # Yield now if sort
             if self.sort:
                 # Close pipe and yield result
-                sort_pipe.stdin.close()
-                yield from (line.strip() for line in sort_pipe.stdout)
+                writeSortInput(sort_pipe, close=True)
+                yield from sortedLines(sort_pipe)
 
     def _parallel_job(self, seq):
         """ Convert a single seq and return a list
@@ -910,6 +1073,10 @@ def parseArgs(sys_args):
             nargs="+",
             type=int,
             help="Sort based on these columns, 0-based indexing")
+    parser.add_argument(
+            "--sort-compress",
+            type=str,
+            help="Program to compress temporary sort files, e.g. zstd")
     parser.add_argument(
             "--output",
             help="Write output to file as opposed to terminal")
@@ -940,7 +1107,8 @@ def main():
                        sort=args.sort,
                        sortnp=args.sort_np,
                        sortmem=args.sort_mem,
-                       sortcols=args.sort_cols)
+                       sortcols=args.sort_cols,
+                       sortcompress=args.sort_compress)
 
     # Pass args.file into kstream and print or write result
     if args.output is not None:
@@ -0,0 +1,24 @@
+from krisp.krisp_fasta.Amplicon import Amplicon, ConservedEndAmplicons
+import random
+import unittest
+
+
+class TestFilterAlignments(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(0)
+
+    def test_has_ingroup_unique_columns(self):
+        labels = ["in0", "in1", "out0", "out1", "out2"]
+        for _ in range(500):
+            alignment = ConservedEndAmplicons(["in0", "in1"])
+            diag_len = random.randint(1, 3)
+            for label in random.sample(labels, random.randint(1, len(labels))):
+                diag = ''.join(random.choice("AC") for _ in range(diag_len))
+                alignment += Amplicon("ACGT", diag, "TTGA", label)
+            self.assertEqual(alignment.hasIngroupUniqueColumns(),
+                             len(alignment.ingroupUniqueColumns()) > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+from krisp.krisp_fasta.kmerExtraction import extractKmerRows, readKmerRows, readSequences, splitLayout
+from krisp.kstream import kstream
+import os
+import random
+import tempfile
+import unittest
+
+
+class TestKmerExtraction(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(0)
+        records = []
+        for i in range(4):
+            seq = ''.join(random.choice(alpha) for alpha, n in
+                          [("ACGT", 120), ("acgtN", 15), ("ACGTRY", 60)]
+                          for _ in range(n))
+            lines = [seq[j:j + 60] for j in range(0, len(seq), 60)]
+            records.append(f">seq{i}\n" + '\n'.join(lines))
+        records.append(">short\nACG")
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fasta = os.path.join(self.tmpdir.name, "test.fasta")
+        with open(self.fasta, "w") as fout:
+            print(*records, sep='\n', file=fout)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_split_layout(self):
+        self.assertEqual(splitLayout(10, [3, -2]), [(0, 3), (3, 8), (8, 10)])
+        self.assertEqual(splitLayout(10, [3, 0]), [(0, 3), (3, 3), (3, 10)])
+        self.assertEqual(splitLayout(10, [0, -4]), [(0, 0), (0, 6), (6, 10)])
+
+    def test_matches_kstream(self):
+        for k, split in [(26, [25, 0]), (12, [4, -3]), (8, [0, -2])]:
+            for omit in [True, False]:
+                soft = {"omitsoft": True} if omit else {"mapsoft": True}
+                expected = kstream(self.fasta, kmers=k, disallow="Nn",
+                                   complements=True, split=split, **soft)
+                rows = extractKmerRows(list(readSequences(self.fasta)), k, split, omit)
+                self.assertEqual(sorted(bytes(r).decode() for r in rows),
+                                 sorted(expected))
+
+    def test_read_kmer_rows(self):
+        kmer_file = os.path.join(self.tmpdir.name, "kmers")
+        with open(kmer_file, "w") as fout:
+            print("AC,G,T", "TT,A,C", sep='\n', file=fout)
+        rows = readKmerRows(kmer_file)
+        self.assertEqual([bytes(r) for r in rows], [b"AC,G,T", b"TT,A,C"])
+
+
+if __name__ == '__main__':
+    unittest.main()
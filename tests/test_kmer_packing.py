@@ -0,0 +1,82 @@
+from krisp.krisp_fasta.kmerPacking import (packColumns, kmerOrder,
+                                           writeKmerRecords, readKmerRecords,
+                                           RECORD_HEADER_SIZE, bucketIndices)
+from krisp.krisp_fasta.shared import bucketBoundaries, bucketIndex
+import io
+import numpy as np
+import random
+import subprocess
+import unittest
+
+
+def _as_columns(seqs):
+    return np.array([list(s.encode()) for s in seqs], dtype=np.uint8)
+
+
+def _sort_lines(lines):
+    if len(lines) == 0:
+        return lines
+    return [lines[i] for i in kmerOrder(_as_columns(lines))]
+
+
+class TestKmerPacking(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(0)
+
+    def test_pack_columns(self):
+        packed, packable = packColumns(_as_columns(["ACGTA", "TTTTT", "ACNTA"]))
+        self.assertEqual(packed.shape, (3, 2))
+        self.assertEqual(list(packed[0]), [0b00011011, 0b00000000])
+        self.assertEqual(list(packed[1]), [0b11111111, 0b11000000])
+        self.assertEqual(list(packable), [True, True, False])
+
+    def test_pack_columns_order(self):
+        seqs = [''.join(random.choice("ACGT") for _ in range(7)) for _ in range(200)]
+        packed, _ = packColumns(_as_columns(seqs))
+        by_packed = sorted(range(len(seqs)), key=lambda i: bytes(packed[i]))
+        self.assertEqual([seqs[i] for i in by_packed], sorted(seqs))
+
+    def test_sort_matches_sort_utility(self):
+        for alphabet in ["ACGT", "ACGTRY"]:
+            lines = [','.join(''.join(random.choice(alphabet) for _ in range(n))
+                              for n in (6, 2, 5))
+                     for _ in range(1000)]
+            expected = subprocess.run("LC_ALL=C sort -t, -k1,1 -k3,3", shell=True,
+                                      input='\n'.join(lines) + '\n',
+                                      capture_output=True, text=True).stdout.split('\n')[:-1]
+            self.assertEqual(_sort_lines(lines), expected)
+
+    def test_records_round_trip(self):
+        lines = [','.join(''.join(random.choice("ACGT") for _ in range(n))
+                          for n in (9, 1, 6))
+                 for _ in range(100)]
+        fout = io.BytesIO()
+        self.assertTrue(writeKmerRecords(_as_columns(lines), fout))
+        self.assertEqual(len(fout.getvalue()), RECORD_HEADER_SIZE + 100 * 4)
+        fout.seek(0)
+        header = fout.read(RECORD_HEADER_SIZE)
+        read = [l.decode() for l in readKmerRecords(fout, header)]
+        self.assertEqual(read, [l + '\n' for l in lines])
+
+    def test_records_unpackable(self):
+        fout = io.BytesIO()
+        self.assertFalse(writeKmerRecords(_as_columns(["AC,G,NT"]), fout))
+        self.assertFalse(writeKmerRecords(_as_columns(["ACGT"]), fout))
+        self.assertEqual(fout.getvalue(), b"")
+
+    def test_bucket_indices(self):
+        lines = [','.join(''.join(random.choice("ACGTN") for _ in range(n))
+                          for n in (5, 2, 5))
+                 for _ in range(1000)]
+        for buckets in [1, 3, 16, 70]:
+            boundaries = bucketBoundaries(buckets)
+            self.assertEqual(list(bucketIndices(_as_columns(lines), boundaries)),
+                             [bucketIndex(l, boundaries) for l in lines])
+
+    def test_sort_empty(self):
+        self.assertEqual(_sort_lines([]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
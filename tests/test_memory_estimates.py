@@ -0,0 +1,87 @@
+from krisp.krisp_fasta.krisp_fasta import (estimateBases, estimateSortBytes,
+                                           sortMemoryShares, writeSortedKmers)
+from krisp.krisp_fasta.kmerExtraction import extractKmerRows, readSequences
+from krisp.krisp_fasta.shared import parseSize
+import bz2
+import gzip
+import os
+import random
+import tempfile
+import tracemalloc
+import unittest
+
+
+class TestMemoryEstimates(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(0)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _file(self, name, data):
+        filename = os.path.join(self.tmpdir.name, name)
+        with open(filename, "wb") as fout:
+            fout.write(data)
+        return filename
+
+    def test_parse_size(self):
+        self.assertEqual(parseSize("4G"), 4 * 1024 ** 3)
+        self.assertEqual(parseSize("500MB"), 500 * 1024 ** 2)
+        self.assertEqual(parseSize(" 1.5k "), 1536)
+        self.assertEqual(parseSize("1024"), 1024)
+        for bad in ["", "lots", "4X", "G"]:
+            with self.assertRaises(ValueError):
+                parseSize(bad)
+
+    def test_estimate_bases(self):
+        seq = b">seq\n" + b"ACGT" * 5000 + b"\n"
+        self.assertEqual(estimateBases(self._file("a.fa", seq)), len(seq))
+
+        # The gzip trailer holds the uncompressed size
+        compressed = gzip.compress(seq)
+        self.assertEqual(estimateBases(self._file("a.fa.gz", compressed)), len(seq))
+
+        # Incompressible data has a trailer smaller than the file, as does a
+        # file with a wrapped size, so a compression ratio is assumed
+        noise = gzip.compress(random.randbytes(5000))
+        self.assertEqual(estimateBases(self._file("n.fa.gz", noise)), len(noise) * 4)
+
+        compressed = bz2.compress(seq)
+        self.assertEqual(estimateBases(self._file("a.fa.bz2", compressed)),
+                         len(compressed) * 4)
+
+    def test_sort_memory_shares(self):
+        for sizes in [[1000], [1000, 1, 1, 1], [5, 5, 5, 5, 5], [300, 200, 100, 1, 0]]:
+            files = [self._file(f"f{i}.fa", b"A" * size) for i, size in enumerate(sizes)]
+            for parallel in [1, 2, 4, 8]:
+                shares = [int(s.rstrip("%")) for s in sortMemoryShares(files, parallel)]
+                self.assertTrue(all(share >= 1 for share in shares))
+                # Jobs run largest first, so the largest running jobs bound the total
+                running = sorted(shares, reverse=True)[:parallel]
+                self.assertLessEqual(sum(running), 80)
+        self.assertEqual(sortMemoryShares(files[:1], 1), ["80%"])
+
+    def test_sort_bytes_bound(self):
+        # Peak memory of sorting kmers in memory stays within the estimate,
+        # with 2 bit packed keys and, with ambiguity codes, ASCII keys
+        for alphabet in ["ACGT", "ACGTRY"]:
+            seq = ''.join(random.choice(alphabet) for _ in range(200000))
+            fasta = self._file(f"{alphabet}.fa", f">seq\n{seq}\n".encode())
+            for ampl_len in [30, 100]:
+                with self.subTest(alphabet=alphabet, ampl_len=ampl_len):
+                    tracemalloc.start()
+                    try:
+                        rows = extractKmerRows(list(readSequences(fasta)),
+                                               ampl_len, [25, -2])
+                        writeSortedKmers(rows, self._file("sorted", b""))
+                        del rows
+                        peak = tracemalloc.get_traced_memory()[1]
+                    finally:
+                        tracemalloc.stop()
+                    self.assertLessEqual(peak, estimateSortBytes(fasta, ampl_len))
+
+
+if __name__ == '__main__':
+    unittest.main()
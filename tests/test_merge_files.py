@@ -0,0 +1,104 @@
+from krisp.krisp_fasta.shared import (alignmentStream, intersectSortedStreams,
+                                      writeAlignmentStream, kmerFileOffset,
+                                      kmerLines)
+from krisp.krisp_fasta.intersectAmplicons import mergeFiles
+from krisp.krisp_fasta.kmerPacking import kmerOrder, writeKmerRecords
+import numpy as np
+import functools
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+class TestMergeFiles(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(0)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _kmer_file(self, name, count, binary=False):
+        # Few distinct primers so most are shared between files
+        lines = [','.join([''.join(random.choice("AC") for _ in range(4)),
+                           random.choice("ACGT"),
+                           ''.join(random.choice("AC") for _ in range(3))])
+                 for _ in range(count)]
+        rows = np.frombuffer(''.join(lines).encode(), dtype=np.uint8)
+        rows = rows.reshape(len(lines), -1)
+        order = kmerOrder(rows)
+        lines = [lines[i] for i in order]
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, "wb") as fout:
+            if binary:
+                writeKmerRecords(rows[order], fout)
+            else:
+                fout.write(''.join(l + '\n' for l in lines).encode())
+        return filename, lines
+
+    def test_kmer_file_offset(self):
+        for binary in [False, True]:
+            filename, lines = self._kmer_file(f"f{binary}", 300, binary)
+            for key in ["", "AAAA", "ACAC", "CA", "CCCC", "D"]:
+                offset = kmerFileOffset(filename, key)
+                rest = [l.decode().strip() for l in kmerLines(filename, offset)]
+                self.assertEqual(rest, [l for l in lines if l.split(',')[0] >= key])
+
+    def test_merge_matches_pairwise(self):
+        files = [self._kmer_file(f"g{i}", 200, i % 2 == 1)[0] for i in range(5)]
+
+        # Expected output from pairwise intersections
+        expected_file = os.path.join(self.tmpdir, "expected")
+        streams = [alignmentStream(f) for f in files]
+        writeAlignmentStream(functools.reduce(intersectSortedStreams, streams),
+                             expected_file)
+        with open(expected_file) as fin:
+            expected = fin.read()
+        self.assertNotEqual(expected, "")
+
+        for parallel in [1, 3]:
+            output = os.path.join(self.tmpdir, f"merged{parallel}")
+            mergeFiles(list(files), output, parallel, self.tmpdir, False)
+            with open(output) as fin:
+                self.assertEqual(fin.read(), expected)
+
+    def test_merge_under_file_limit(self):
+        # All primer pairs are drawn often, so many are found in every file
+        files = [self._kmer_file(f"h{i}", 1000, i % 2 == 1)[0] for i in range(300)]
+        expected_file = os.path.join(self.tmpdir, "expected")
+        streams = [alignmentStream(f) for f in files]
+        # Pairwise intersections nest a generator per file
+        recursion = sys.getrecursionlimit()
+        sys.setrecursionlimit(10000)
+        try:
+            writeAlignmentStream(functools.reduce(intersectSortedStreams, streams),
+                                 expected_file)
+        finally:
+            sys.setrecursionlimit(recursion)
+        with open(expected_file) as fin:
+            expected = fin.read()
+        self.assertNotEqual(expected, "")
+
+        # Merge with fewer open files allowed than there are files
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (128, hard))
+        try:
+            for parallel in [1, 3]:
+                output = os.path.join(self.tmpdir, f"merged{parallel}")
+                mergeFiles(list(files), output, parallel, self.tmpdir, False)
+                with open(output) as fin:
+                    self.assertEqual(fin.read(), expected)
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         sorted([os.path.basename(f) for f in files]
+                                + ["expected", "merged1", "merged3"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+from krisp.krisp_fasta import outputAlignments
+from unittest import mock
+import io
+import unittest
+
+
+class TestWriteBlock(unittest.TestCase):
+
+    def _write(self, block, newline=None):
+        raw = io.BytesIO()
+        stream = io.TextIOWrapper(raw, encoding="utf-8", newline=newline)
+        stream.write("header\n")
+        outputAlignments._write_block(stream, block)
+        return raw.getvalue()
+
+    def test_matches_text_layer(self):
+        block = "ACGT,A,└Forward┘\nTTGA,C,-\n"
+        self.assertEqual(self._write(block), ("header\n" + block).encode())
+
+    def test_translates_newlines(self):
+        # Text streams write '\n' as os.linesep, e.g. '\r\n' on Windows
+        with mock.patch.object(outputAlignments.os, "linesep", "\r\n"):
+            written = self._write("a\nb\n", newline="\r\n")
+        self.assertEqual(written, b"header\r\na\r\nb\r\n")
+
+    def test_text_stream(self):
+        stream = io.StringIO()
+        outputAlignments._write_block(stream, "a\nb\n")
+        self.assertEqual(stream.getvalue(), "a\nb\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
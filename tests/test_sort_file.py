@@ -0,0 +1,76 @@
+from krisp.kstream.kstream import kstream, sortFile, sortInPlace
+from unittest import mock
+import os
+import random
+import subprocess
+import tempfile
+import unittest
+
+
+class TestSortFile(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(0)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input = self._path("input")
+        with open(self.input, "w") as fout:
+            print("C,A,T", "A,C,G", "A,A,C", sep='\n', file=fout)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def test_sort_file(self):
+        output = self._path("output")
+        sortFile(self.input, output, cols=[0, 2])
+        with open(output) as fin:
+            self.assertEqual(fin.read().split(), ["A,A,C", "A,C,G", "C,A,T"])
+
+    def test_failing_sort(self):
+        # Put a sort which always fails first on the path
+        bindir = self._path("bin")
+        os.mkdir(bindir)
+        with open(os.path.join(bindir, "sort"), "w") as fout:
+            print("#!/bin/sh", "exit 2", sep='\n', file=fout)
+        os.chmod(os.path.join(bindir, "sort"), 0o755)
+        path = bindir + os.pathsep + os.environ["PATH"]
+        with mock.patch.dict(os.environ, {"PATH": path}):
+            with self.assertRaises(subprocess.CalledProcessError):
+                sortFile(self.input, self._path("output"))
+
+    def test_sort_in_place(self):
+        os.chmod(self.input, 0o644)
+        sortInPlace(self.input, cols=[0, 2])
+        with open(self.input) as fin:
+            self.assertEqual(fin.read().split(), ["A,A,C", "A,C,G", "C,A,T"])
+        self.assertEqual(os.stat(self.input).st_mode & 0o777, 0o644)
+        self.assertEqual(os.listdir(self.tmpdir.name), ["input"])
+
+    def test_failing_compress_program(self):
+        # Enough lines for sort to spill compressed temporary files
+        lines = [str(random.randrange(10 ** 9)) for _ in range(300000)]
+        with open(self.input, "w") as fout:
+            print(*lines, sep='\n', file=fout)
+        with open(self.input) as fin:
+            contents = fin.read()
+
+        # The file to sort is left as it was
+        with self.assertRaises(subprocess.CalledProcessError):
+            sortInPlace(self.input, mem="1M", compress="false")
+        with open(self.input) as fin:
+            self.assertEqual(fin.read(), contents)
+        self.assertEqual(os.listdir(self.tmpdir.name), ["input"])
+
+        # Streamed kmers are sorted through a pipe
+        seq = ''.join(random.choice("ACGT") for _ in range(200000))
+        for parallel in [1, 2]:
+            kmers = kstream([seq], kmers=20, sort=True, sortmem="1M",
+                            sortcompress="false", parallel=parallel)
+            with self.assertRaises(subprocess.CalledProcessError):
+                list(kmers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+from krisp.krisp_fasta.krisp_fasta import sortedKmersBucketed, sortedKmersSerial
+from krisp.krisp_fasta.intersectAmplicons import mergeFiles
+from contextlib import contextmanager
+from unittest import mock
+import gzip
+import os
+import random
+import signal
+import subprocess
+import tempfile
+import unittest
+
+
+@contextmanager
+def time_limit(seconds):
+    # Fail rather than hang when a run blocks on its pipes
+    def handler(signum, frame):
+        raise TimeoutError(f"Run didn't finish in {seconds}s")
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.alarm(seconds)
+    try:
+        yield
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class TestSortedKmersBucketed(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(0)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+        # Mutated copies of one sequence, so many amplicons are shared
+        base = [random.choice("ACGT") for _ in range(3000)]
+        self.files = []
+        for i in range(3):
+            seq = [random.choice("ACGT") if random.random() < 0.02 else b
+                   for b in base]
+            filename = self._path(f"in{i}.fa.gz")
+            with gzip.open(filename, "wt") as fout:
+                print(">seq", ''.join(seq), sep='\n', file=fout)
+            self.files.append(filename)
+
+        # Merge of kmer files extracted one file at a time
+        self.expected = self._merged("expected", self._extract_serial)
+        self.assertNotEqual(self.expected, "")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _path(self, *names):
+        return os.path.join(self.tmpdir.name, *names)
+
+    def _merged(self, name, extract):
+        # Kmer files have the same names in every run as they label the output
+        workdir = self._path(name)
+        os.mkdir(workdir)
+        outputs = [os.path.join(workdir, f"in{i}.12mers") for i in range(len(self.files))]
+        output = os.path.join(workdir, "merged")
+        extract(outputs, output, workdir)
+        with open(output) as fin:
+            return fin.read()
+
+    def _extract_serial(self, outputs, output, workdir):
+        sortedKmersSerial(self.files, outputs, 12, 5, 2, verbose=False)
+        mergeFiles(outputs, output, 1, workdir, False)
+
+    def _extract_bucketed(self, buckets, parallel, threshold):
+        def extract(outputs, output, workdir):
+            with time_limit(60):
+                sortedKmersBucketed(self.files, outputs, output, 12, 5, 2,
+                                    buckets, parallel, workdir, verbose=False,
+                                    in_memory_threshold_bytes=threshold)
+        return extract
+
+    def test_matches_merge(self):
+        # Pipes are used when every file is extracted at once
+        cases = [(3, 3, 0), (3, 2, 0), (3, 3, 1 << 30), (3, 2, 1 << 30),
+                 (5, 3, 0), (16, 2, 1 << 30), (1, 3, 0)]
+        for buckets, parallel, threshold in cases:
+            with self.subTest(buckets=buckets, parallel=parallel,
+                              threshold=threshold):
+                name = f"b{buckets}_p{parallel}_t{threshold}"
+                extract = self._extract_bucketed(buckets, parallel, threshold)
+                self.assertEqual(self._merged(name, extract), self.expected)
+
+    def test_failing_input(self):
+        # A truncated file fails part way through its extraction
+        with open(self.files[1], "rb") as fin:
+            data = fin.read()
+        with open(self.files[1], "wb") as fout:
+            fout.write(data[:len(data) // 2])
+
+        for parallel in [3, 2]:
+            for threshold in [0, 1 << 30]:
+                with self.subTest(parallel=parallel, threshold=threshold):
+                    extract = self._extract_bucketed(4, parallel, threshold)
+                    with self.assertRaises(EOFError):
+                        self._merged(f"p{parallel}_t{threshold}", extract)
+
+    def test_failing_sort(self):
+        # Put a sort which always fails first on the path
+        bindir = self._path("bin")
+        os.mkdir(bindir)
+        with open(os.path.join(bindir, "sort"), "w") as fout:
+            print("#!/bin/sh", "exit 2", sep='\n', file=fout)
+        os.chmod(os.path.join(bindir, "sort"), 0o755)
+
+        path = bindir + os.pathsep + os.environ["PATH"]
+        with mock.patch.dict(os.environ, {"PATH": path}):
+            for parallel in [3, 2]:
+                with self.subTest(parallel=parallel):
+                    extract = self._extract_bucketed(4, parallel, 0)
+                    with self.assertRaises(subprocess.CalledProcessError):
+                        self._merged(f"p{parallel}", extract)
+
+
+if __name__ == '__main__':
+    unittest.main()